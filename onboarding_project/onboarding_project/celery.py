@@ -1,21 +1,52 @@
 from __future__ import absolute_import, unicode_literals
 import os
-import django
 from celery import Celery
+from celery.schedules import crontab
+from celery.signals import beat_init, task_postrun, worker_init
+from squad_pantry_app import pool, routers
+from squad_pantry_app.schedules import ConfigurationSettingsSchedule
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'onboarding_project.settings')
-django.setup()
 
+# Celery sets Django up when a worker or beat starts, importing the app does not touch the database
 app = Celery('onboarding_project', broker='pyamqp://guest@localhost//', include=['onboarding_project.tasks'])
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-from squad_pantry_app.models import ConfigurationSettings
-schedule_interval = int(ConfigurationSettings.objects.get(constant='INTERVAL').value)
+metrics_schedule = ConfigurationSettingsSchedule('INTERVAL', default=10)
 
 app.conf.beat_schedule = {
-    'add-every-10-seconds': {
+    'calc-performance-metrics': {
         'task': 'onboarding_project.tasks.calc_performance_metrics',
-        'schedule': schedule_interval
+        'schedule': metrics_schedule,
+    },
+    # order requests are placed right after they arrive, this catches requests whose run was lost
+    'place-pending-orders': {
+        'task': 'onboarding_project.tasks.place_pending_orders',
+        'schedule': 60,
+    },
+    'fold-dish-demand-nightly': {
+        'task': 'onboarding_project.tasks.fold_dish_demand',
+        'schedule': crontab(hour=0, minute=15),
+    },
+    'archive-closed-orders-nightly': {
+        'task': 'onboarding_project.tasks.archive_closed_orders',
+        'schedule': crontab(hour=3, minute=0),
     },
 }
+
+
+@worker_init.connect
+def use_worker_pool(**kwargs):
+    pool.set_process_type(pool.WORKER)
+
+
+@beat_init.connect
+def use_beat_pool(**kwargs):
+    pool.set_process_type(pool.BEAT)
+
+
+@task_postrun.connect
+def unpin_after_task(**kwargs):
+    # worker threads run one task after another, the writes of one should not pin the reads of the next
+    routers.unpin()
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'squad_pantry_app.SquadUser'
 
 MIDDLEWARE = [
+    'squad_pantry_app.middleware.PerformanceMiddleware',
+    'squad_pantry_app.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,8 +56,56 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Requests slower than this are logged to the squad_pantry_app.performance logger
+SLOW_REQUEST_THRESHOLD_MS = 500
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'squad_pantry_app.performance': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 ROOT_URLCONF = 'onboarding_project.urls'
 
+# Seconds a ConfigurationSettings value is cached in each process.
+# Saves invalidate the cache of the saving process, other processes pick the change up within this delay.
+CONFIGURATION_SETTINGS_CACHE_TTL = 60
+
+# Seconds the menu of available dishes is cached. Saving a Dish rebuilds it straight away.
+MENU_CACHE_TTL = 300
+
+# Seconds the performance metrics windows trail the current time by. closed_at is set before the transaction
+# delivering an order commits, so an order closed just before the end of a window can become visible after it.
+METRICS_WINDOW_LAG = 5
+
+# Pub/sub carrying order status changes to the /orders/events/ streams.
+# The in-memory broker only reaches clients connected to the process that saved the order, so the orders placed by
+# the Celery workers for mode=async requests are only seen by polling them. squad_pantry_app.events.KombuBroker
+# carries the events between processes through the message broker at ORDER_EVENTS_BROKER_URL.
+ORDER_EVENTS_BROKER = 'squad_pantry_app.events.InMemoryBroker'
+ORDER_EVENTS_BROKER_URL = 'pyamqp://guest@localhost//'
+# Seconds between keep-alive comments on an idle event stream
+ORDER_EVENTS_HEARTBEAT = 15
+
+# Orders created with mode=async are placed this many seconds after they arrive, together with the
+# other requests received meanwhile, at most ORDER_REQUEST_BATCH_SIZE per transaction.
+ORDER_REQUEST_DELAY = 1
+ORDER_REQUEST_BATCH_SIZE = 500
+
+# Orders moved to the archive per transaction.
+# Closed orders are archived once older than the ARCHIVE_AFTER_DAYS ConfigurationSettings constant.
+ARCHIVE_BATCH_SIZE = 1000
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
@@ -85,7 +135,7 @@ WSGI_APPLICATION = 'onboarding_project.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'squad_pantry_app.backends.postgresql_pool',
         'NAME': 'onboarding',
         'USER': 'postgres',
         'PASSWORD': 'squadrun',
@@ -94,6 +144,26 @@ DATABASES = {
     }
 }
 
+# Alias in DATABASES of a read replica of 'default'. The order history, the metrics page and the exports read from
+# it, other reads and all writes go to 'default'. Locally, a copy of the database can stand in for the replica, e.g.
+# DATABASES['replica'] = dict(DATABASES['default'], NAME='onboarding_replica') with REPLICA_DATABASE = 'replica'.
+DATABASE_ROUTERS = ['squad_pantry_app.routers.ReplicaRouter']
+REPLICA_DATABASE = None
+# Seconds a client keeps reading from 'default' after it wrote, to cover the replication lag
+REPLICA_PIN_SECONDS = 10
+
+# Connections of the postgresql_pool backend, per database and per process type. Processes are 'web' unless the
+# SQUAD_PANTRY_PROCESS environment variable says otherwise, Celery workers and beat switch when they start.
+# MAX_SIZE - connections per process, at least the number of threads of a web process
+# TIMEOUT - seconds to wait for a free connection before failing
+# MAX_AGE - seconds after which a connection is closed and replaced
+# HEALTH_CHECK_AFTER - idle seconds after which a connection is checked with SELECT 1 before use
+DATABASE_POOL = {
+    'web': {'MAX_SIZE': 10, 'TIMEOUT': 5, 'MAX_AGE': 1800, 'HEALTH_CHECK_AFTER': 30},
+    'worker': {'MAX_SIZE': 2, 'TIMEOUT': 30, 'MAX_AGE': 1800, 'HEALTH_CHECK_AFTER': 30},
+    'beat': {'MAX_SIZE': 1, 'TIMEOUT': 30, 'MAX_AGE': 600, 'HEALTH_CHECK_AFTER': 0},
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -1,7 +1,56 @@
-from onboarding_project.celery import app
-from squad_pantry_app.models import PerformanceMetrics
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from onboarding_project.celery import app, metrics_schedule
+from squad_pantry_app.forecasting import fold_demand
+from squad_pantry_app.models import ArchivedOrder, ConfigurationSettings, OrderRequest, PerformanceMetrics
 
 
 @app.task
 def calc_performance_metrics():
-    PerformanceMetrics.create_avg_performance_metrics()
+    """
+    Calculate the metrics of the orders delivered since the last run.
+    Runs queued up within half an interval of the last one are skipped, the next run covers their orders.
+    """
+    PerformanceMetrics.create_avg_performance_metrics(min_window=metrics_schedule.run_every / 2)
+
+
+@app.task
+def archive_closed_orders():
+    """
+    Move orders closed more than ARCHIVE_AFTER_DAYS ago to the archive, ARCHIVE_BATCH_SIZE at a time.
+    Nothing is archived unless ARCHIVE_AFTER_DAYS is configured.
+    """
+    try:
+        archive_after_days = ConfigurationSettings.get_int('ARCHIVE_AFTER_DAYS')
+    except ConfigurationSettings.DoesNotExist:
+        return 0
+
+    closed_before = timezone.now() - timedelta(days=archive_after_days)
+    archived = 0
+    while True:
+        moved = ArchivedOrder.archive_batch(closed_before, settings.ARCHIVE_BATCH_SIZE)
+        archived += moved
+        if moved < settings.ARCHIVE_BATCH_SIZE:
+            return archived
+
+
+@app.task
+def place_pending_orders():
+    """
+    Place the pending order requests, ORDER_REQUEST_BATCH_SIZE per transaction
+    """
+    placed = 0
+    while True:
+        processed = OrderRequest.place_pending(settings.ORDER_REQUEST_BATCH_SIZE)
+        placed += processed
+        if processed < settings.ORDER_REQUEST_BATCH_SIZE:
+            return placed
+
+
+@app.task
+def fold_dish_demand():
+    """
+    Fold the dish demand of the days up to yesterday into the forecast
+    """
+    return fold_demand(timezone.localdate() - timedelta(days=1))
@@ -2,10 +2,13 @@ from django import forms
 from django.conf.urls import *
 from django.forms import BaseInlineFormSet
 from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
 from django.http import HttpResponseRedirect
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from squad_pantry_app.models import Dish, Order, OrderDishRelation, SquadUser, ConfigurationSettings, PerformanceMetrics
+from squad_pantry_app.models import KitchenSlot, OpenOrderCounter
+from squad_pantry_app.exports import CSV, NDJSON, export_action
 
 
 class BaseOrderDishFormset(BaseInlineFormSet):
@@ -24,6 +27,14 @@ class BaseOrderDishFormset(BaseInlineFormSet):
         else:
             if len(filled_form) < 1:
                 raise forms.ValidationError('Enter at least One Dish')
+            order = self.instance
+            if order.pk is None and order.scheduled_time is not None:
+                slot_start = KitchenSlot.get_slot_start(order.scheduled_time)
+                available = KitchenSlot.get_available(slot_start)
+                prep_time = sum(form.cleaned_data['dish'].prep_time_in_minutes * form.cleaned_data['quantity']
+                                for form in filled_form)
+                if available is not None and available < prep_time:
+                    raise forms.ValidationError(Order.SLOT_FULL_ERROR.format(slot_start))
 
 
 class OrderDishInline(admin.StackedInline):
@@ -34,6 +45,13 @@ class OrderDishInline(admin.StackedInline):
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "dish":
             kwargs["queryset"] = Dish.objects.filter(is_available=True)
+            field = super(OrderDishInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
+            # render the dropdown from the cached menu, the queryset is only hit to validate the chosen dish
+            field.choices = [('', field.empty_label)] + [
+                (dish['id'], str(Dish(dish_name=dish['dish_name'], prep_time_in_minutes=dish['prep_time_in_minutes'])))
+                for dish in Dish.get_menu()['dishes']
+            ]
+            return field
         return super(OrderDishInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
 
     def get_readonly_fields(self, request, obj=None):
@@ -42,6 +60,12 @@ class OrderDishInline(admin.StackedInline):
         else:
             return self.readonly_fields + ('dish', 'quantity')
 
+    def get_max_num(self, request, obj=None, **kwargs):
+        # the dishes of a placed order can not change, they are booked in its kitchen slot
+        if obj is not None:
+            return 0
+        return super(OrderDishInline, self).get_max_num(request, obj, **kwargs)
+
 
 class DishAdmin(admin.ModelAdmin):
     list_display = ['dish_name', 'dish_type', 'is_available', 'prep_time_in_minutes']
@@ -56,9 +80,11 @@ class DishAdmin(admin.ModelAdmin):
 class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderDishInline, ]
     exclude = ('placed_by', )
-    readonly_fields = ('closed_at', )
+    readonly_fields = ('closed_at', 'start_by', )
     list_filter = ('status', )
-    list_display = ('placed_by', 'status', 'created_at', 'scheduled_time')
+    list_display = ('placed_by', 'status', 'created_at', 'scheduled_time', 'start_by', 'total_items',
+                    'total_prep_minutes')
+    actions = [export_action('orders', CSV), export_action('orders', NDJSON)]
 
     def has_delete_permission(self, request, obj=None):
         return False
@@ -94,11 +120,36 @@ class OrderAdmin(admin.ModelAdmin):
 
             return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
 
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super(OrderAdmin, self).changeform_view(request, object_id, form_url, extra_context)
+        except ValidationError as error:
+            # raised while saving, once the forms were validated, the whole change was rolled back
+            self.message_user(request, ' '.join(error.messages), messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.placed_by = request.user
+            # clean() only checked the limit, the admission is taken here as place_order does
+            if not OpenOrderCounter.reserve(ConfigurationSettings.get_int('ORDER_LIMIT')):
+                raise ValidationError(Order.HEAVY_TRAFFIC_ERROR)
+            obj._capacity_reserved = True
         return super(OrderAdmin, self).save_model(request, obj, form, change)
 
+    def save_related(self, request, form, formsets, change):
+        super(OrderAdmin, self).save_related(request, form, formsets, change)
+        if not change:
+            # the dishes are only saved now, so the order is placed in two steps
+            order = form.instance
+            if not order.prepare_placement(Order.get_order_dishes([order.pk]).get(order.pk, [])):
+                # the slot filled up since the form was validated
+                raise ValidationError(Order.SLOT_FULL_ERROR.format(order.booked_slot))
+            Order.objects.filter(pk=order.pk).update(
+                start_by=order.start_by, total_items=order.total_items, total_prep_minutes=order.total_prep_minutes,
+                dish_summary=order.dish_summary, booked_slot=order.booked_slot, booked_load=order.booked_load)
+            Order.record_placement([order])
+
     def get_readonly_fields(self, request, obj=None):
         kitchen_staff = request.user.is_kitchen_staff
         make_readonly_status = kitchen_staff and obj.status in obj.CLOSED_ORDERS and obj.closed_at is not None
@@ -194,8 +245,9 @@ class ConfigurationSettingsAdmin(admin.ModelAdmin):
 
 
 class PerformanceMetricAdmin(admin.ModelAdmin):
-    list_display = ('created_at', 'average_throughput', 'average_turnaround_time', )
+    list_display = ('created_at', 'window_start', 'window_end', 'average_throughput', 'average_turnaround_time', )
     readonly_fields = ('average_throughput', 'average_turnaround_time', )
+    actions = [export_action('performance_metrics', CSV), export_action('performance_metrics', NDJSON)]
 
 
 admin.site.register(Dish, DishAdmin)
@@ -0,0 +1,41 @@
+from squad_pantry_app.models import Order, OrderStatusEvent
+
+
+def get_stage_durations(start, end, chunk_size=2000):
+    """
+    Time spent between consecutive statuses and number of transitions into each status, over the status
+    events logged in [start, end). Events are read in a single streaming pass, ordered by order and time,
+    so memory does not grow with the range. Stages are counted when both their events fall in the range.
+
+    Returns a dict with
+    stages - dict of (from status, to status) -> dict with the count, total and average duration
+    throughput - dict of status -> number of orders that reached it
+
+    Keyword arguments:
+    start - Start of the range
+    end - End of the range
+    chunk_size - Number of events fetched from the database at a time
+    """
+    events = OrderStatusEvent.objects.filter(created_at__gte=start, created_at__lt=end).order_by(
+        'order_id', 'created_at', 'id').values_list('order_id', 'status', 'created_at')
+
+    stages = {}
+    throughput = {}
+    previous_order_id = previous_status = previous_created_at = None
+    for order_id, status, created_at in events.iterator(chunk_size=chunk_size):
+        throughput[status] = throughput.get(status, 0) + 1
+        if order_id == previous_order_id:
+            stage = stages.setdefault((previous_status, status), {'count': 0, 'total': None})
+            duration = created_at - previous_created_at
+            stage['count'] += 1
+            stage['total'] = duration if stage['total'] is None else stage['total'] + duration
+        previous_order_id, previous_status, previous_created_at = order_id, status, created_at
+
+    for stage in stages.values():
+        stage['average'] = stage['total'] / stage['count']
+    return {'stages': stages, 'throughput': throughput}
+
+
+def get_stage_name(from_status, to_status):
+    statuses = dict(Order.STATUS)
+    return '{0} to {1}'.format(statuses[from_status], statuses[to_status])
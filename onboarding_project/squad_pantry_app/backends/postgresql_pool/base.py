@@ -0,0 +1,59 @@
+from functools import partial
+from django.db.backends.postgresql import base, creation
+from squad_pantry_app.pool import close_pools, get_pool
+
+Database = base.Database
+
+
+def check(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if not connection.autocommit:
+        connection.rollback()
+
+
+def reset(connection):
+    if connection.closed:
+        raise Database.InterfaceError('connection already closed')
+    if connection.get_transaction_status() != Database.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # PostgreSQL refuses to drop a database other sessions are connected to
+        close_pools(self.connection.alias)
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend taking its connections from a squad_pantry_app.pool.ConnectionPool of the process and giving
+    them back instead of closing them, so requests and tasks skip the connection setup. Django still "closes" the
+    connection at the end of every request or task, CONN_MAX_AGE should stay 0 and the pool MAX_AGE be used instead.
+    """
+    creation_class = DatabaseCreation
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        # kept to give the connection back to the pool it came from, even if the settings changed meanwhile
+        self.pool = get_pool(self.alias, conn_params['database'], partial(Database.connect, **conn_params),
+                             check=check, reset=reset)
+        connection = self.pool.checkout()
+
+        # as in the postgresql backend, a pooled connection keeps the isolation level it was given when opened
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.checkin(self.connection)
@@ -0,0 +1,236 @@
+import random
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from squad_pantry_app.instrumentation import RequestSample
+from squad_pantry_app.models import Dish, Order, OrderDishRelation, SquadUser, OpenOrderCounter, \
+    PerformanceMetrics, OrderStatusEvent, skip_order_totals
+from squad_pantry_app.views import OrderViewSet
+
+BENCHMARK_USERNAME_PREFIX = 'bench'
+BENCHMARK_PASSWORD = 'benchmark'
+BENCHMARK_DISH_PREFIX = 'Benchmark Dish '
+
+# share of the seeded closed orders per status
+CLOSED_STATUS_WEIGHTS = ((Order.DELIVERED, 85), (Order.CANCELLED, 12), (Order.REJECTED, 3))
+
+
+@contextmanager
+def keep_created_at():
+    """
+    Let bulk_create write the created_at of seeded orders instead of the current time
+
+    """
+    field = Order._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def batches(total, batch_size):
+    for start in range(0, total, batch_size):
+        yield min(batch_size, total - start)
+
+
+def seed_dishes(count):
+    existing = Dish.objects.filter(dish_name__startswith=BENCHMARK_DISH_PREFIX).count()
+    Dish.objects.bulk_create([
+        Dish(dish_name='{0}{1}'.format(BENCHMARK_DISH_PREFIX, i), dish_type=random.choice(Dish.DISH_TYPE)[0],
+             is_available=True, prep_time_in_minutes=random.randint(2, 30))
+        for i in range(existing, count)
+    ])
+    return list(Dish.objects.filter(dish_name__startswith=BENCHMARK_DISH_PREFIX).values_list(
+        'id', 'dish_name', 'prep_time_in_minutes'))
+
+
+def seed_users(count, batch_size):
+    """
+    Create benchmark users up to count, all with BENCHMARK_PASSWORD
+
+    """
+    existing = SquadUser.objects.filter(username__startswith=BENCHMARK_USERNAME_PREFIX).count()
+    password = make_password(BENCHMARK_PASSWORD)
+    for start in range(existing, count, batch_size):
+        SquadUser.objects.bulk_create([
+            SquadUser(username='{0}{1}'.format(BENCHMARK_USERNAME_PREFIX, i), password=password)
+            for i in range(start, min(start + batch_size, count))
+        ])
+    return list(SquadUser.objects.filter(username__startswith=BENCHMARK_USERNAME_PREFIX).values_list('id', flat=True))
+
+
+def insert_orders(orders):
+    """
+    bulk_create the orders and return their ids, in order
+
+    """
+    if connection.features.can_return_ids_from_bulk_insert:
+        return [order.id for order in Order.objects.bulk_create(orders)]
+    # the seeding process is the only writer, so the newest ids are the ones just inserted
+    Order.objects.bulk_create(orders)
+    return sorted(Order.objects.order_by('-id').values_list('id', flat=True)[:len(orders)])
+
+
+def seed_orders(count, user_ids, dishes, days, open_orders, batch_size, log=None):
+    """
+    Create count orders spread over the last days, all closed except the open_orders most recent ones.
+    Orders are written with bulk_create, so they have no status events.
+
+    Keyword arguments:
+    count - number of orders to create
+    user_ids - users placing the orders
+    dishes - list of (dish id, dish name, prep time in minutes) to pick from
+    days - how far back the orders go
+    open_orders - number of orders left open, they are placed within the last hour
+    batch_size - number of orders inserted per query
+    log - callable reporting progress
+    """
+    now = timezone.now()
+    statuses, weights = zip(*CLOSED_STATUS_WEIGHTS)
+    created = 0
+    with keep_created_at():
+        for size in batches(count, batch_size):
+            orders = []
+            order_dishes = []
+            for i in range(size):
+                is_open = count - created - i <= open_orders
+                if is_open:
+                    created_at = now - timedelta(seconds=random.uniform(0, 3600))
+                else:
+                    created_at = now - timedelta(seconds=random.uniform(3600, days * 86400))
+                picked = random.sample(dishes, random.randint(1, min(3, len(dishes))))
+                quantities = [random.randint(1, 2) for _ in picked]
+                prep_time = sum(prep * quantity for (dish_id, name, prep), quantity in zip(picked, quantities))
+
+                order = Order(placed_by_id=random.choice(user_ids), created_at=created_at,
+                              start_by=Order.get_start_by(created_at, prep_time))
+                order.set_totals([(dish_id, name, prep, quantity)
+                                  for (dish_id, name, prep), quantity in zip(picked, quantities)])
+                if not is_open:
+                    order.status = random.choices(statuses, weights)[0]
+                    if order.status == Order.DELIVERED:
+                        order.accepted_at = created_at + timedelta(seconds=random.uniform(30, 300))
+                        order.closed_at = order.accepted_at + timedelta(minutes=prep_time,
+                                                                        seconds=random.uniform(0, 600))
+                    else:
+                        order.closed_at = created_at + timedelta(seconds=random.uniform(30, 600))
+                orders.append(order)
+                order_dishes.append(list(zip(picked, quantities)))
+
+            order_ids = insert_orders(orders)
+            OrderDishRelation.objects.bulk_create([
+                OrderDishRelation(order_id=order_id, dish_id=dish_id, quantity=quantity)
+                for order_id, dishes_of_order in zip(order_ids, order_dishes)
+                for (dish_id, name, prep), quantity in dishes_of_order
+            ])
+            created += size
+            if log is not None:
+                log('{0}/{1} orders'.format(created, count))
+    OpenOrderCounter.rebuild()
+
+
+def seed(users, orders, dishes=20, days=90, open_orders=100, batch_size=10000, log=None):
+    """
+    Seed benchmark dishes, users and orders with bulk inserts
+
+    """
+    dish_rows = seed_dishes(dishes)
+    user_ids = seed_users(users, batch_size)
+    seed_orders(orders, user_ids, dish_rows, days, open_orders, batch_size, log)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def measure(function, repeat):
+    """
+    Run function repeat times and return its latency in milliseconds and the queries it ran per call
+
+    """
+    latencies = []
+    queries = []
+    for i in range(repeat):
+        sample = RequestSample()
+        with connection.execute_wrapper(sample.execute):
+            start = time.perf_counter()
+            function(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(sample.queries)
+    return {
+        'runs': repeat,
+        'mean_ms': round(sum(latencies) / repeat, 3),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'max_ms': round(max(latencies), 3),
+        'queries': round(sum(queries) / repeat, 2),
+        'max_queries': max(queries),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(user, repeat):
+    """
+    Measure the ordering hot path for the given user and return the results, ready to be dumped as JSON.
+    Orders placed by the place_order benchmark are cancelled by the cancel_order one and deleted at the end,
+    so every run measures the same data.
+
+    Keyword arguments:
+    user - user placing and listing orders, preferably one with a long order history
+    repeat - number of calls measured per benchmark
+    """
+    dishes = list(Dish.objects.filter(is_available=True)[:3])
+    order_dishes = [{'dish': dish, 'quantity': 1} for dish in dishes]
+    placed = []
+    # the paginator builds absolute links, so the request needs a host the settings allow
+    host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*', ) and not host.startswith('.')),
+                'localhost')
+    factory = APIRequestFactory(HTTP_HOST=host)
+    order_list = OrderViewSet.as_view({'get': 'list'})
+
+    def place_order(i):
+        placed.append(Order.place_order(None, user, order_dishes))
+
+    def list_orders(i):
+        request = factory.get('/orders/')
+        force_authenticate(request, user)
+        order_list(request).render()
+
+    benchmarks = [
+        ('place_order', place_order),
+        ('check_limit', lambda i: Order.check_limit()),
+        ('order_list', list_orders),
+        ('cancel_order', lambda i: placed[i].cancel_order(user.id)),
+        ('calculate_avg_performance_metrics', lambda i: PerformanceMetrics.calculate_avg_performance_metrics()),
+    ]
+    results = {
+        'commit': get_commit(),
+        'django': django.get_version(),
+        'database': connections['default'].vendor,
+        'orders': Order.objects.count(),
+        'user_orders': Order.objects.filter(placed_by=user).count(),
+    }
+    try:
+        results['benchmarks'] = {name: measure(function, repeat) for name, function in benchmarks}
+    finally:
+        # open orders left by a failed run are released as they are deleted
+        placed_ids = [order.id for order in placed if order is not None]
+        OrderStatusEvent.objects.filter(order_id__in=placed_ids).delete()
+        with skip_order_totals():
+            Order.objects.filter(id__in=placed_ids).delete()
+    return results
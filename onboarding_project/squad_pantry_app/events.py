@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.utils.module_loading import import_string
+from kombu import Connection, Exchange, Queue
+from kombu.exceptions import OperationalError
+from kombu.pools import producers
+
+
+class Subscription(object):
+    """
+    Messages published to a channel after subscribing, read with get()
+    """
+
+    def __init__(self, broker, channel, messages):
+        self.broker = broker
+        self.channel = channel
+        self.messages = messages
+
+    def get(self, timeout=None):
+        """
+        Wait up to timeout seconds for the next message, None if there was none
+
+        """
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self.channel, self.messages)
+
+
+class InMemoryBroker(object):
+    """
+    Publish/subscribe between the threads of a single process.
+    A subscriber that falls more than MAX_PENDING messages behind misses the newest ones instead of
+    slowing down the publisher.
+    """
+    MAX_PENDING = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for messages in subscribers:
+            try:
+                messages.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def subscribe(self, channel):
+        messages = queue.Queue(maxsize=self.MAX_PENDING)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(messages)
+        return Subscription(self, channel, messages)
+
+    def unsubscribe(self, channel, messages):
+        with self.lock:
+            subscribers = self.subscribers.get(channel, set())
+            subscribers.discard(messages)
+            if not subscribers:
+                self.subscribers.pop(channel, None)
+
+
+class KombuBroker(InMemoryBroker):
+    """
+    Publish/subscribe between processes through a fanout exchange on the message broker at
+    settings.ORDER_EVENTS_BROKER_URL, so that orders placed by the Celery workers reach the streams of the web
+    processes. A process starts consuming with its first subscription, from a queue of its own, and hands the
+    messages to its subscribers as InMemoryBroker does. Messages published while the message broker is down are lost.
+    """
+    EXCHANGE = 'squad_pantry.order_events'
+    CONNECT_TIMEOUT = 2
+    RECONNECT_DELAY = 5
+
+    def __init__(self, url=None):
+        super(KombuBroker, self).__init__()
+        self.url = url or settings.ORDER_EVENTS_BROKER_URL
+        self.exchange = Exchange(self.EXCHANGE, type='fanout', durable=False, delivery_mode='transient')
+        self.consumer = None
+        self.consuming = threading.Event()
+
+    def connect(self):
+        return Connection(self.url, connect_timeout=self.CONNECT_TIMEOUT)
+
+    def publish(self, channel, message):
+        connection = self.connect()
+        try:
+            with producers[connection].acquire(block=True) as producer:
+                producer.publish({'channel': channel, 'message': message}, exchange=self.exchange,
+                                 declare=[self.exchange], serializer='json', retry=False)
+        except (OperationalError, ) + connection.connection_errors:
+            logging.exception('Could not publish to %s', channel)
+
+    def subscribe(self, channel):
+        with self.lock:
+            if self.consumer is None:
+                self.consumer = threading.Thread(target=self.consume, name='order-events', daemon=True)
+                self.consumer.start()
+        return super(KombuBroker, self).subscribe(channel)
+
+    def consume(self):
+        events = Queue(exchange=self.exchange, durable=False, exclusive=True, auto_delete=True)
+        while True:
+            connection = self.connect()
+            try:
+                with connection.Consumer(events, callbacks=[self.deliver], accept=['json'], no_ack=True):
+                    self.consuming.set()
+                    while True:
+                        connection.drain_events()
+            except (OperationalError, ) + connection.connection_errors + connection.channel_errors:
+                logging.exception('Lost the order events of %s', self.url)
+            finally:
+                self.consuming.clear()
+                connection.release()
+            time.sleep(self.RECONNECT_DELAY)
+
+    def deliver(self, body, message):
+        super(KombuBroker, self).publish(body['channel'], body['message'])
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    The broker of this process, an instance of settings.ORDER_EVENTS_BROKER
+
+    """
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.ORDER_EVENTS_BROKER)()
+    return _broker
+
+
+def order_channel(user_id):
+    return 'orders:{0}'.format(user_id)
+
+
+def publish_order_status(order):
+    """
+    Let the user who placed the order know about its current status
+
+    Keyword arguments:
+    order - order whose status changed
+    """
+    get_broker().publish(order_channel(order.placed_by_id), {
+        'id': order.id,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'closed_at': order.closed_at.isoformat() if order.closed_at else None,
+    })
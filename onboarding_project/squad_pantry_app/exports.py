@@ -0,0 +1,81 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from squad_pantry_app.models import Order, OrderDishRelation, PerformanceMetrics
+from squad_pantry_app.routers import get_read_database
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = {
+    CSV: 'text/csv',
+    NDJSON: 'application/x-ndjson',
+}
+
+# name -> (model, exported columns)
+EXPORTS = {
+    'orders': (Order, ('id', 'placed_by__username', 'status', 'scheduled_time', 'created_at', 'accepted_at',
+                       'closed_at', 'start_by', 'total_items', 'total_prep_minutes')),
+    'order_dishes': (OrderDishRelation, ('order_id', 'dish_id', 'dish__dish_name', 'quantity')),
+    'performance_metrics': (PerformanceMetrics, ('created_at', 'window_start', 'window_end', 'average_throughput',
+                                                 'average_turnaround_time')),
+}
+
+
+class Echo(object):
+    """
+    File-like object handing back what csv.writer writes, so rows can be yielded one by one
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_export(name, export_format, queryset=None, chunk_size=2000, using=None):
+    """
+    Yield the lines of an export. Rows are read as tuples through a server-side cursor, chunk_size at a time,
+    so memory stays flat whatever the number of rows.
+
+    Keyword arguments:
+    name - key of EXPORTS
+    export_format - CSV or NDJSON
+    queryset - rows to export, all of them if None
+    chunk_size - number of rows fetched from the database at a time
+    using - database to read from, the one the routers pick if None
+    """
+    model, fields = EXPORTS[name]
+    if queryset is None:
+        queryset = model.objects.all()
+    if using is not None:
+        queryset = queryset.using(using)
+    rows = queryset.order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size)
+
+    if export_format == CSV:
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def export_response(name, export_format, queryset=None):
+    # the rows are read once the view has returned, so the database is picked now
+    response = StreamingHttpResponse(stream_export(name, export_format, queryset, using=get_read_database()),
+                                     content_type=FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(name, export_format)
+    return response
+
+
+def export_action(name, export_format):
+    """
+    Admin action streaming the selected rows in the given format
+
+    """
+    def export(modeladmin, request, queryset):
+        return export_response(name, export_format, queryset)
+
+    export.short_description = 'Export selected as {0}'.format(export_format.upper())
+    export.__name__ = 'export_{0}'.format(export_format)
+    return export
@@ -0,0 +1,113 @@
+from datetime import timedelta
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from squad_pantry_app.locks import try_lock
+from squad_pantry_app.models import DemandForecast, Dish, DishDemand, DishDemandCount
+
+LOCK_NAME = 'squad_pantry_app:demand_forecast'
+# estimates below this are dropped rather than stored
+MIN_ESTIMATE = 0.01
+
+
+def fold_demand(through_day):
+    """
+    Fold the counts of the days after the last folded one, up to through_day included, into the
+    per dish, per slot moving averages. Every day weighs SMOOTHING, days without orders included.
+    Returns the number of days folded.
+
+    Keyword arguments:
+    through_day - last day to fold, usually yesterday
+    """
+    with transaction.atomic():
+        with try_lock(LOCK_NAME) as acquired:
+            if not acquired:
+                return 0
+
+            forecast = DemandForecast.get()
+            counts = DishDemandCount.objects.filter(day__lte=through_day)
+            if forecast.folded_through is not None:
+                first_day = forecast.folded_through + timedelta(days=1)
+                counts = counts.filter(day__gte=first_day)
+            else:
+                first_day = counts.order_by('day').values_list('day', flat=True).first()
+            if first_day is None or first_day > through_day:
+                return 0
+
+            dish_ids = list(Dish.objects.order_by('id').values_list('id', flat=True))
+            dish_index = {dish_id: index for index, dish_id in enumerate(dish_ids)}
+            days = (through_day - first_day).days + 1
+
+            estimates = np.zeros((len(dish_ids), DishDemand.SLOTS))
+            for dish_id, slot, estimate in DishDemand.objects.values_list('dish_id', 'slot', 'estimate'):
+                estimates[dish_index[dish_id], slot] = estimate
+
+            # days x dishes x slots
+            day_counts = np.zeros((days, len(dish_ids), DishDemand.SLOTS))
+            for day, dish_id, slot, quantity in counts.values_list('day', 'dish_id', 'slot', 'quantity').iterator():
+                day_counts[(day - first_day).days, dish_index[dish_id], slot] = quantity
+
+            if forecast.folded_through is None:
+                # start the averages from the first day rather than from zero
+                estimates = day_counts[0]
+                day_counts = day_counts[1:]
+            # e_n = (1 - a)^n e_0 + sum over days i of a (1 - a)^(n - 1 - i) c_i
+            smoothing = DishDemand.SMOOTHING
+            weights = smoothing * (1 - smoothing) ** np.arange(len(day_counts) - 1, -1, -1)
+            estimates = (1 - smoothing) ** len(day_counts) * estimates + np.tensordot(weights, day_counts, axes=1)
+
+            DishDemand.objects.all().delete()
+            dish_indexes, slots = np.nonzero(estimates >= MIN_ESTIMATE)
+            DishDemand.objects.bulk_create([
+                DishDemand(dish_id=dish_ids[index], slot=int(slot), estimate=float(estimates[index, slot]))
+                for index, slot in zip(dish_indexes, slots)
+            ])
+            forecast.folded_through = through_day
+            forecast.save()
+    return days
+
+
+def get_prep_ahead(start, slots=4):
+    """
+    Dishes the kitchen can expect in the slots from the one containing start, as a list of
+    (slot start, list of dicts with the dish, its forecast, the quantity already ordered and the expected quantity),
+    the most expected dish first. Scheduled orders are counted in the slot they are needed in,
+    so the expected quantity is the larger of the forecast and what is already ordered.
+
+    Keyword arguments:
+    start - time to look ahead from
+    slots - number of slots to look at
+    """
+    start = timezone.localtime(start)
+    first_slot = start.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(
+        minutes=DishDemandCount.get_slot(start)[1] * DishDemand.SLOT_MINUTES)
+    slot_starts = [first_slot + timedelta(minutes=i * DishDemand.SLOT_MINUTES) for i in range(slots)]
+    slot_keys = [DishDemandCount.get_slot(slot_start) for slot_start in slot_starts]
+
+    dishes = dict(Dish.objects.values_list('id', 'dish_name'))
+    forecasts = np.zeros((len(dishes), DishDemand.SLOTS))
+    dish_ids = sorted(dishes)
+    dish_index = {dish_id: index for index, dish_id in enumerate(dish_ids)}
+    for dish_id, slot, estimate in DishDemand.objects.filter(slot__in={slot for day, slot in slot_keys}).values_list(
+            'dish_id', 'slot', 'estimate'):
+        forecasts[dish_index[dish_id], slot] = estimate
+
+    ordered = np.zeros((len(dish_ids), slots))
+    slot_positions = {key: position for position, key in enumerate(slot_keys)}
+    counts = DishDemandCount.objects.filter(day__in={day for day, slot in slot_keys},
+                                            slot__in={slot for day, slot in slot_keys})
+    for day, slot, dish_id, quantity in counts.values_list('day', 'slot', 'dish_id', 'quantity'):
+        if (day, slot) in slot_positions:
+            ordered[dish_index[dish_id], slot_positions[(day, slot)]] = quantity
+
+    forecast = forecasts[:, [slot for day, slot in slot_keys]]
+    expected = np.maximum(forecast, ordered)
+    prep_ahead = []
+    for position, slot_start in enumerate(slot_starts):
+        dishes_in_slot = [
+            {'dish': dishes[dish_ids[index]], 'forecast': round(float(forecast[index, position]), 1),
+             'ordered': int(ordered[index, position]), 'expected': int(np.ceil(expected[index, position]))}
+            for index in np.argsort(-expected[:, position], kind='stable') if expected[index, position] >= 0.5
+        ]
+        prep_ahead.append((slot_start, dishes_in_slot))
+    return prep_ahead
@@ -0,0 +1,124 @@
+import threading
+import time
+from contextlib import contextmanager
+from squad_pantry_app.sketch import QuantileSketch
+
+_local = threading.local()
+
+
+class RequestSample(object):
+    """
+    Timings of a single request, filled in while it is being handled
+    """
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def execute(self, execute, sql, params, many, context):
+        """
+        connection.execute_wrapper counting the query and the time spent running it
+
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+    def values(self):
+        return {
+            'wall_time_ms': self.wall_time * 1000,
+            'queries': self.queries,
+            'sql_time_ms': self.sql_time * 1000,
+            'serializer_time_ms': self.serializer_time * 1000,
+        }
+
+
+@contextmanager
+def serializer_timer():
+    """
+    Count the time spent in the block as serializer time of the current request.
+    Nested serializers are only counted once, by the outermost one.
+    """
+    sample = getattr(_local, 'sample', None)
+    if sample is None:
+        yield
+        return
+
+    sample.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.serializer_depth -= 1
+        if sample.serializer_depth == 0:
+            sample.serializer_time += time.perf_counter() - start
+
+
+class RequestHistograms(object):
+    """
+    Histograms of the request timings of this process, one set per view name
+    """
+    METRICS = ('wall_time_ms', 'queries', 'sql_time_ms', 'serializer_time_ms')
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view_name, sample):
+        values = sample.values()
+        with self.lock:
+            view = self.views.get(view_name)
+            if view is None:
+                view = self.views[view_name] = {
+                    'requests': 0,
+                    'totals': dict.fromkeys(self.METRICS, 0),
+                    'sketches': {metric: QuantileSketch() for metric in self.METRICS},
+                }
+            view['requests'] += 1
+            for metric in self.METRICS:
+                view['totals'][metric] += values[metric]
+                view['sketches'][metric].add(values[metric])
+
+    def summary(self):
+        """
+        Request count, mean and percentiles of every metric, per view name
+
+        """
+        with self.lock:
+            summary = {}
+            for view_name, view in self.views.items():
+                summary[view_name] = {'requests': view['requests']}
+                for metric in self.METRICS:
+                    sketch = view['sketches'][metric]
+                    summary[view_name][metric] = dict(
+                        [('mean', round(view['totals'][metric] / view['requests'], 2))] +
+                        [('p{0}'.format(percentile), round(sketch.quantile(percentile / 100.0), 2))
+                         for percentile in self.PERCENTILES]
+                    )
+            return summary
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+_histograms = RequestHistograms()
+
+
+def get_request_histograms():
+    return _histograms
+
+
+def set_current_sample(sample):
+    """
+    Have serializer_timer count into sample, None once the request is over
+
+    """
+    _local.sample = sample
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from http.client import HTTPConnection, HTTPException
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlparse
+
+
+class Client(object):
+    """
+    API client of one user, logged in once through the REST framework login view and keeping its connection open
+    """
+
+    def __init__(self, base_url, username, password):
+        url = urlparse(base_url)
+        self.host = url.netloc
+        self.cookies = SimpleCookie()
+        self.connection = None
+        self.username = username
+        self.password = password
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send a request, reconnecting once if the server closed the connection.
+        Returns the status and the body of the response.
+
+        """
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join('{0}={1}'.format(key, morsel.value) for key, morsel in self.cookies.items())
+        if 'csrftoken' in self.cookies:
+            headers['X-CSRFToken'] = self.cookies['csrftoken'].value
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = HTTPConnection(self.host, timeout=30)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                content = response.read()
+                break
+            except (HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        for header in response.msg.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+        return response.status, content
+
+    def login(self):
+        self.request('GET', '/api-auth/login/')
+        body = urlencode({'username': self.username, 'password': self.password,
+                          'csrfmiddlewaretoken': self.cookies['csrftoken'].value})
+        self.request('POST', '/api-auth/login/', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        if 'sessionid' not in self.cookies:
+            raise ValueError('Could not log in as {0}'.format(self.username))
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, data):
+        return self.request('POST', path, json.dumps(data), {'Content-Type': 'application/json'})
+
+
+class Recorder(object):
+    """
+    Latencies and status codes of the requests made by all the clients, per endpoint
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, status, latency):
+        with self.lock:
+            results = self.endpoints.setdefault(endpoint, {'latencies': [], 'statuses': {}})
+            results['latencies'].append(latency)
+            results['statuses'][status] = results['statuses'].get(status, 0) + 1
+
+    def timed(self, endpoint, function, *args):
+        start = time.perf_counter()
+        try:
+            status, content = function(*args)
+        except (HTTPException, OSError):
+            status, content = 'connection error', None
+        self.record(endpoint, status, (time.perf_counter() - start) * 1000)
+        return status, content
+
+    def summary(self, duration):
+        summary = {}
+        for endpoint, results in sorted(self.endpoints.items()):
+            latencies = sorted(results['latencies'])
+            summary[endpoint] = {
+                'requests': len(latencies),
+                'requests_per_second': round(len(latencies) / duration, 2),
+                'statuses': {str(status): count for status, count in results['statuses'].items()},
+                'p50_ms': round(latencies[int(0.5 * (len(latencies) - 1))], 3),
+                'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+                'p99_ms': round(latencies[int(0.99 * (len(latencies) - 1))], 3),
+                'max_ms': round(latencies[-1], 3),
+            }
+        return summary
+
+
+def lunch_rush(base_url, usernames, password, bursts, burst_interval, orders_per_burst):
+    """
+    Simulate lunch-rush bursts: every client loads the menu, places orders and reloads its order list at the same
+    moment, once per burst. Returns the latencies and statuses per endpoint.
+
+    Keyword arguments:
+    base_url - server to drive, e.g. http://localhost:8000
+    usernames - one client is started per user
+    password - password of the users
+    bursts - number of bursts
+    burst_interval - seconds between the start of two bursts
+    orders_per_burst - orders each client places per burst
+    """
+    clients = [Client(base_url, username, password) for username in usernames]
+    for client in clients:
+        client.login()
+
+    recorder = Recorder()
+    barrier = threading.Barrier(len(clients))
+
+    def drive(client):
+        for burst in range(bursts):
+            barrier.wait()
+            burst_start = time.monotonic()
+            status, content = recorder.timed('dish-list', client.get, '/dishes/')
+            dishes = json.loads(content.decode()) if status == 200 else []
+            for _ in range(orders_per_burst if dishes else 0):
+                order = {'dishes': [{'dish': dishes[0]['id'], 'quantity': 1}]}
+                recorder.timed('order-list POST', client.post, '/orders/', order)
+            recorder.timed('order-list GET', client.get, '/orders/')
+            time.sleep(max(0, burst_interval - (time.monotonic() - burst_start)))
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=drive, args=(client, )) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - start
+    return {
+        'clients': len(clients),
+        'bursts': bursts,
+        'duration_seconds': round(duration, 3),
+        'endpoints': recorder.summary(duration),
+    }
@@ -0,0 +1,43 @@
+import threading
+import zlib
+from contextlib import contextmanager
+from django.db import connection
+
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+
+
+def get_lock_id(name):
+    """
+    Advisory lock key for a lock name
+
+    """
+    return zlib.crc32(name.encode())
+
+
+@contextmanager
+def try_lock(name):
+    """
+    Try to take the lock called name without waiting and yield whether it was taken.
+    On PostgreSQL this is a transaction level advisory lock shared by every process, so it has to be taken inside
+    transaction.atomic and is held until the transaction ends.
+    Other databases fall back to a lock local to this process.
+
+    Keyword arguments:
+    name - name of the lock
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [get_lock_id(name)])
+            acquired = cursor.fetchone()[0]
+        yield acquired
+        return
+
+    with _local_locks_lock:
+        lock = _local_locks.setdefault(name, threading.Lock())
+    acquired = lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock.release()
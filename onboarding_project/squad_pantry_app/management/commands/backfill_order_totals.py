@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Case, Value, When
+from squad_pantry_app.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Fill in total_items, total_prep_minutes and dish_summary of orders placed before they existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders updated per transaction')
+
+    def handle(self, *args, **options):
+        pending = Order.objects.filter(dish_summary='').order_by('id')
+        last_id = 0
+        updated = 0
+        while True:
+            order_ids = list(pending.filter(id__gt=last_id).values_list('id', flat=True)[:options['batch_size']])
+            if not order_ids:
+                break
+            last_id = order_ids[-1]
+
+            order_dishes = Order.get_order_dishes(order_ids)
+            orders = []
+            for order_id in order_ids:
+                order = Order(id=order_id)
+                order.set_totals(order_dishes.get(order_id, []))
+                orders.append(order)
+
+            with transaction.atomic():
+                # one UPDATE for the whole batch
+                Order.objects.filter(id__in=order_ids).update(**{
+                    field: Case(*[When(id=order.id, then=Value(getattr(order, field))) for order in orders],
+                                output_field=output_field)
+                    for field, output_field in [('total_items', models.IntegerField()),
+                                                ('total_prep_minutes', models.IntegerField()),
+                                                ('dish_summary', models.TextField())]
+                })
+            updated += len(order_ids)
+            self.stdout.write('{0} orders updated'.format(updated))
+        self.stdout.write(self.style.SUCCESS('Backfilled the totals of {0} orders'.format(updated)))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from squad_pantry_app.exports import CSV, EXPORTS, FORMATS, stream_export
+from squad_pantry_app.routers import get_read_database
+
+
+class Command(BaseCommand):
+    help = 'Stream orders, order dishes or performance metrics as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default=CSV)
+        parser.add_argument('--output', help='File to write to, standard output by default')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        lines = stream_export(options['name'], options['format'], chunk_size=options['chunk_size'],
+                              using=get_read_database())
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,28 @@
+import json
+from django.core.management.base import BaseCommand
+from squad_pantry_app.benchmarks import BENCHMARK_PASSWORD, BENCHMARK_USERNAME_PREFIX
+from squad_pantry_app.loadtest import lunch_rush
+
+
+class Command(BaseCommand):
+    help = 'Drive lunch-rush bursts of concurrent clients against a running server and print the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Server to drive')
+        parser.add_argument('--clients', type=int, default=50, help='Concurrent clients, one benchmark user each')
+        parser.add_argument('--bursts', type=int, default=5)
+        parser.add_argument('--burst-interval', type=float, default=10, help='Seconds between bursts')
+        parser.add_argument('--orders-per-burst', type=int, default=1, help='Orders placed by each client per burst')
+        parser.add_argument('--output', help='File to write the JSON results to, standard output by default')
+
+    def handle(self, *args, **options):
+        usernames = ['{0}{1}'.format(BENCHMARK_USERNAME_PREFIX, i) for i in range(options['clients'])]
+        results = lunch_rush(options['url'], usernames, BENCHMARK_PASSWORD, options['bursts'],
+                             options['burst_interval'], options['orders_per_burst'])
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as results_file:
+                results_file.write(output)
+        else:
+            self.stdout.write(output)
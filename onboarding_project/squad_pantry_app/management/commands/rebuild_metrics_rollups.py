@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from squad_pantry_app.models import MetricsRollup, PerformanceMetrics
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the metrics rollups from the delivered orders already covered by the performance metrics'
+
+    def handle(self, *args, **options):
+        watermark = PerformanceMetrics.get_watermark()
+        if watermark is None:
+            self.stdout.write('No performance metrics calculated yet, nothing to roll up')
+            return
+
+        with transaction.atomic():
+            MetricsRollup.objects.all().delete()
+            MetricsRollup.record_window(None, watermark)
+        self.stdout.write(self.style.SUCCESS('Rolled up orders delivered until {0}'.format(watermark)))
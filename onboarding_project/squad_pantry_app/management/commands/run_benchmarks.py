@@ -0,0 +1,38 @@
+import json
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from squad_pantry_app.benchmarks import BENCHMARK_USERNAME_PREFIX, run_benchmarks
+from squad_pantry_app.models import SquadUser
+
+
+class Command(BaseCommand):
+    help = 'Measure latency and query count of the ordering hot path and print the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help='Calls measured per benchmark')
+        parser.add_argument('--username', help='User to benchmark with, the benchmark user with most orders by default')
+        parser.add_argument('--output', help='File to write the JSON results to, standard output by default')
+
+    def handle(self, *args, **options):
+        users = SquadUser.objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+        else:
+            users = users.filter(username__startswith=BENCHMARK_USERNAME_PREFIX).annotate(
+                orders=Count('order')).order_by('-orders')
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to benchmark with, run seed_benchmark_data first')
+
+        try:
+            results = run_benchmarks(user, options['repeat'])
+        except ValidationError as error:
+            raise CommandError('{0} Raise ORDER_LIMIT to benchmark place_order'.format(' '.join(error.messages)))
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as results_file:
+                results_file.write(output)
+        else:
+            self.stdout.write(output)
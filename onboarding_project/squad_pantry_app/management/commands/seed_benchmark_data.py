@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from squad_pantry_app.benchmarks import seed
+
+
+class Command(BaseCommand):
+    help = 'Seed benchmark users and orders with bulk inserts, e.g. --users 100000 --orders 10000000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--dishes', type=int, default=20)
+        parser.add_argument('--days', type=int, default=90, help='How far back the orders go')
+        parser.add_argument('--open-orders', type=int, default=100,
+                            help='Number of recent orders left open, the others are closed')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows inserted per query')
+
+    def handle(self, *args, **options):
+        seed(options['users'], options['orders'], options['dishes'], options['days'], options['open_orders'],
+             options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Seeded {0} users and {1} orders'.format(
+            options['users'], options['orders'])))
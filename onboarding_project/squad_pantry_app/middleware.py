@@ -0,0 +1,74 @@
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from squad_pantry_app.instrumentation import RequestSample, get_request_histograms, set_current_sample
+from squad_pantry_app.routers import get_replica, has_written, pin_to_primary, unpin
+
+logger = logging.getLogger('squad_pantry_app.performance')
+
+
+class PerformanceMiddleware(object):
+    """
+    Record wall time, query count, SQL time and serializer time of every request in the histograms of its view.
+    Requests slower than settings.SLOW_REQUEST_THRESHOLD_MS are logged to the squad_pantry_app.performance logger.
+    Streaming responses are timed until the response is returned, not until the stream ends.
+    """
+    UNRESOLVED = '<unresolved>'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample = RequestSample()
+        set_current_sample(sample)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample.execute))
+                response = self.get_response(request)
+        finally:
+            sample.wall_time = time.perf_counter() - start
+            set_current_sample(None)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = resolver_match.view_name if resolver_match else self.UNRESOLVED
+        get_request_histograms().record(view_name, sample)
+
+        if sample.wall_time * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            values = sample.values()
+            logger.warning(
+                'Slow request %s %s view=%s status=%s wall=%.1fms queries=%d sql=%.1fms serializer=%.1fms',
+                request.method, request.get_full_path(), view_name, response.status_code, values['wall_time_ms'],
+                values['queries'], values['sql_time_ms'], values['serializer_time_ms']
+            )
+        return response
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Pin the request to the primary once it writes, and the requests of the same client for
+    settings.REPLICA_PIN_SECONDS after that through a cookie, so clients read their own writes
+    while the replica catches up. Does nothing without settings.REPLICA_DATABASE.
+    """
+    COOKIE_NAME = 'pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if get_replica() is None:
+            return self.get_response(request)
+
+        unpin()
+        if self.COOKIE_NAME in request.COOKIES:
+            pin_to_primary()
+        try:
+            response = self.get_response(request)
+            if has_written():
+                response.set_cookie(self.COOKIE_NAME, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        finally:
+            unpin()
+        return response
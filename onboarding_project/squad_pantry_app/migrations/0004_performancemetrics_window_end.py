@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0003_auto_20180209_1130'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performancemetrics',
+            name='window_end',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Orders closed up to this time are included in the metrics', null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:26
+
+from django.db import migrations, models
+
+
+def seed_open_order_counter(apps, schema_editor):
+    Order = apps.get_model('squad_pantry_app', 'Order')
+    OpenOrderCounter = apps.get_model('squad_pantry_app', 'OpenOrderCounter')
+    db_alias = schema_editor.connection.alias
+    # ORDER_PLACED, ACCEPTED, PROCESSING
+    open_orders = Order.objects.using(db_alias).filter(status__in=[0, 1, 4]).count()
+    OpenOrderCounter.objects.using(db_alias).create(pk=1, open_orders=open_orders)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0004_performancemetrics_window_end'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenOrderCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('open_orders', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_open_order_counter, migrations.RunPython.noop),
+    ]
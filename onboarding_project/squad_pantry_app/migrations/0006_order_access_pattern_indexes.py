@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0005_openordercounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['placed_by', '-created_at'], name='placed_by_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'closed_at'], name='status_closed_at_idx'),
+        ),
+        # ORDER_PLACED, ACCEPTED, PROCESSING. Stays small however many orders have been closed.
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(status__in=[0, 1, 4]), fields=['status'], name='open_orders_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:29
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def backfill_start_by(apps, schema_editor):
+    Order = apps.get_model('squad_pantry_app', 'Order')
+    orders = Order.objects.using(schema_editor.connection.alias)
+    # ORDER_PLACED, ACCEPTED, PROCESSING
+    open_orders = orders.filter(status__in=[0, 1, 4]).annotate(
+        prep_time=Sum(F('orderdishrelation__dish__prep_time_in_minutes') * F('orderdishrelation__quantity')))
+    for order in open_orders:
+        needed_at = order.scheduled_time or order.created_at
+        start_by = needed_at - timedelta(minutes=order.prep_time or 0)
+        orders.filter(pk=order.pk).update(start_by=start_by)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0006_order_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='start_by',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Time the kitchen has to start preparing the order', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(status__in=[0, 1, 4]), fields=['start_by'], name='kitchen_queue_idx'),
+        ),
+        migrations.RunPython(backfill_start_by, migrations.RunPython.noop),
+    ]
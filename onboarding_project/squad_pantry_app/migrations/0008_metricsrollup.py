@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:31
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0007_order_start_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.IntegerField(choices=[(0, 'Minute'), (1, 'Hour'), (2, 'Day')])),
+                ('bucket_start', models.DateTimeField()),
+                ('throughput', models.IntegerField(default=0)),
+                ('total_turnaround_time', models.DurationField(default=datetime.timedelta(0))),
+            ],
+            options={
+                'unique_together': {('granularity', 'bucket_start')},
+            },
+        ),
+    ]
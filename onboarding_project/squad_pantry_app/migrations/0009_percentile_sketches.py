@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0008_metricsrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metricsrollup',
+            name='delivery_sketch',
+            field=models.TextField(blank=True, default='', verbose_name='Delivery (accepted to delivered)'),
+        ),
+        migrations.AddField(
+            model_name='metricsrollup',
+            name='queue_wait_sketch',
+            field=models.TextField(blank=True, default='', verbose_name='Queue wait (placed to accepted)'),
+        ),
+        migrations.AddField(
+            model_name='metricsrollup',
+            name='turnaround_sketch',
+            field=models.TextField(blank=True, default='', verbose_name='Turnaround (placed to delivered)'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='accepted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
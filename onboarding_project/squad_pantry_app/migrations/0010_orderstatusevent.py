@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0009_percentile_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField(choices=[(0, 'Order Placed'), (2, 'Rejected'), (1, 'Accepted'), (3, 'Cancelled'), (4, 'Processing'), (5, 'Delivered')])),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='status_events', to='squad_pantry_app.Order')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='orderstatusevent',
+            index=models.Index(fields=['created_at'], name='status_event_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatusevent',
+            index=models.Index(fields=['order', 'created_at'], name='status_event_order_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0010_orderstatusevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status', models.IntegerField(choices=[(0, 'Order Placed'), (2, 'Rejected'), (1, 'Accepted'), (3, 'Cancelled'), (4, 'Processing'), (5, 'Delivered')])),
+                ('scheduled_time', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('accepted_at', models.DateTimeField(blank=True, null=True)),
+                ('start_by', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('placed_by', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderDishRelation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('dish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='squad_pantry_app.Dish')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='squad_pantry_app.ArchivedOrder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['placed_by', '-created_at'], name='archived_placed_by_idx'),
+        ),
+    ]
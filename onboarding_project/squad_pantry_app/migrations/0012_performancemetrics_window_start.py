@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0011_archived_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performancemetrics',
+            name='window_start',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Orders closed after this time are included in the metrics', null=True, unique=True),
+        ),
+    ]
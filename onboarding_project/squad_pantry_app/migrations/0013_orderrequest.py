@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0012_performancemetrics_window_start'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('handle', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Placed'), (2, 'Failed')], default=0)),
+                ('payload', models.TextField()),
+                ('errors', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='squad_pantry_app.Order')),
+                ('placed_by', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='orderrequest',
+            index=models.Index(fields=['status', 'id'], name='order_request_status_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0013_orderrequest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('folded_through', models.DateField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DishDemandCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('slot', models.SmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('dish', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='squad_pantry_app.Dish')),
+            ],
+            options={
+                'unique_together': {('day', 'slot', 'dish')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DishDemand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.SmallIntegerField()),
+                ('estimate', models.FloatField()),
+                ('dish', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='squad_pantry_app.Dish')),
+            ],
+            options={
+                'unique_together': {('dish', 'slot')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0014_dish_demand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KitchenSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot_start', models.DateTimeField(unique=True)),
+                ('load', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='booked_load',
+            field=models.IntegerField(default=0, editable=False, help_text='Prep minutes booked in the kitchen slot'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='booked_slot',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Start of the kitchen slot booked for the scheduled order', null=True),
+        ),
+    ]
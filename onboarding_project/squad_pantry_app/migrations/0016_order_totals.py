@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squad_pantry_app', '0015_kitchen_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='dish_summary',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_items',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_prep_minutes',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,11 +1,33 @@
+import json
+import time
+import uuid
+import hashlib
 import logging
-from datetime import timedelta
-from django.db.models import Sum
+import threading
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime, timedelta
+from django.db.models import Avg, Case, Count, ExpressionWrapper, F, Q, Sum, Value, When
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
-from django.db import models, transaction, DatabaseError
+from django.db import models, connection, transaction, DatabaseError, IntegrityError
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.functions import Greatest, TruncMinute
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from squad_pantry_app.events import publish_order_status
+from squad_pantry_app.locks import try_lock
+from squad_pantry_app.routers import use_primary
+from squad_pantry_app.sketch import QuantileSketch
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+_local = threading.local()
 
 
 class SquadUser(AbstractUser):
@@ -27,9 +49,34 @@ class Dish(models.Model):
     prep_time_in_minutes = models.IntegerField(
         validators=[MinValueValidator(1)], help_text='Time Taken to Prepare the Dish')
 
+    MENU_CACHE_KEY = 'squad_pantry_app:menu'
+
     def __str__(self):
         return "{0} ({1} Min)".format(self.dish_name, self.prep_time_in_minutes)
 
+    @classmethod
+    def get_menu(cls):
+        """
+        Get the cached menu snapshot, a dict with the available dishes and an etag identifying their contents.
+        The snapshot is rebuilt after a Dish is saved or deleted, or after MENU_CACHE_TTL seconds.
+
+        """
+        menu = cache.get(cls.MENU_CACHE_KEY)
+        if menu is None:
+            dishes = list(Dish.objects.filter(is_available=True).order_by('dish_name').values(
+                'id', 'dish_name', 'dish_type', 'prep_time_in_minutes'))
+            etag = '"{0}"'.format(hashlib.md5(json.dumps(dishes, sort_keys=True).encode()).hexdigest())
+            menu = {'etag': etag, 'dishes': dishes}
+            cache.set(cls.MENU_CACHE_KEY, menu, settings.MENU_CACHE_TTL)
+        return menu
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_delete, sender=Dish)
+def invalidate_menu(sender, instance, **kwargs):
+    # before the commit, a concurrent request would cache the menu again from the old rows
+    transaction.on_commit(partial(cache.delete, Dish.MENU_CACHE_KEY))
+
 
 class Order(models.Model):
     CANCEL_SUCCESS = 100
@@ -45,6 +92,13 @@ class Order(models.Model):
     DELIVERED = 5
 
     CLOSED_ORDERS = [REJECTED, CANCELLED, DELIVERED]
+    OPEN_ORDERS = [ORDER_PLACED, ACCEPTED, PROCESSING]
+    # closed without being prepared, giving their kitchen slot back
+    RELEASED_ORDERS = [REJECTED, CANCELLED]
+
+    SLOT_FULL_ERROR = 'The kitchen is fully booked at {0:%H:%M}, pick another time.'
+    HEAVY_TRAFFIC_ERROR = 'Due to heavy traffic, Squad Pantry can not accept your order.'
+    PAST_DATE_ERROR = 'Past dates are not allowed'
 
     STATUS = (
         (ORDER_PLACED, 'Order Placed'),
@@ -62,28 +116,93 @@ class Order(models.Model):
         help_text='Schedule Your Order. Leave it blank for getting your order as soon as possible')
     created_at = models.DateTimeField(auto_now_add=True)
     closed_at = models.DateTimeField(blank=True, null=True, editable=False)
+    accepted_at = models.DateTimeField(blank=True, null=True, editable=False)
+    start_by = models.DateTimeField(blank=True, null=True, editable=False,
+                                    help_text='Time the kitchen has to start preparing the order')
+    booked_slot = models.DateTimeField(blank=True, null=True, editable=False,
+                                       help_text='Start of the kitchen slot booked for the scheduled order')
+    booked_load = models.IntegerField(default=0, editable=False,
+                                      help_text='Prep minutes booked in the kitchen slot')
+    # copied from the dishes of the order when it is placed, so reads need no joins
+    total_items = models.IntegerField(default=0, editable=False)
+    total_prep_minutes = models.IntegerField(default=0, editable=False)
+    # JSON list of [dish id, dish name, quantity]
+    dish_summary = models.TextField(blank=True, default='', editable=False)
+
+    # status as last read from or written to the database, used to keep OpenOrderCounter in step
+    _loaded_status = None
+    # set when place_order has already reserved a slot in OpenOrderCounter for this order
+    _capacity_reserved = False
 
     class Meta:
         indexes = [
-            models.Index(fields=['created_at'], name='created_at_idx')
+            models.Index(fields=['created_at'], name='created_at_idx'),
+            # a user's order history, newest first
+            models.Index(fields=['placed_by', '-created_at'], name='placed_by_created_at_idx'),
+            # delivered orders in a closed_at window, for the performance metrics
+            models.Index(fields=['status', 'closed_at'], name='status_closed_at_idx'),
+            # partial indexes on the open orders, ORDER_PLACED, ACCEPTED and PROCESSING, which stay small
+            # however many orders have been closed
+            models.Index(fields=['status'], name='open_orders_idx', condition=Q(status__in=[0, 1, 4])),
+            # the kitchen queue
+            models.Index(fields=['start_by'], name='kitchen_queue_idx', condition=Q(status__in=[0, 1, 4])),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Order, cls).from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
     def clean(self):
         if self.scheduled_time is not None and self.scheduled_time < timezone.now():
-            raise ValidationError('Past dates are not allowed')
+            raise ValidationError(self.PAST_DATE_ERROR)
         if self.status == self.CANCELLED and self.closed_at is None:
             raise ValidationError('As a SquadPantry you can not cancel an Order')
+        if self.is_reopened() and self.booked_slot is not None:
+            available = KitchenSlot.get_available(self.booked_slot)
+            if available is not None and available < self.booked_load:
+                raise ValidationError(self.SLOT_FULL_ERROR.format(self.booked_slot))
         if not self.pk:
             is_limit_exceeded = self.check_limit()
             if is_limit_exceeded:
-                raise ValidationError('Due to heavy traffic, Squad Pantry can not accept your order.')
+                raise ValidationError(self.HEAVY_TRAFFIC_ERROR)
 
     def save(self, *args, **kwargs):
+        now = timezone.now()
         if self.status in self.CLOSED_ORDERS and self.closed_at is None:
-            self.closed_at = timezone.now()
-        super(Order, self).save(*args, **kwargs)
+            self.closed_at = now
+        if self.status in [self.ACCEPTED, self.PROCESSING] and self.accepted_at is None:
+            self.accepted_at = now
+
+        if self._state.adding:
+            was_open = self._capacity_reserved
+        else:
+            was_open = self._loaded_status in self.OPEN_ORDERS
+        is_open = self.status in self.OPEN_ORDERS
+        status_changed = self._state.adding or self.status != self._loaded_status
+
+        if is_open == was_open and not status_changed:
+            super(Order, self).save(*args, **kwargs)
+        else:
+            with transaction.atomic():
+                if self.is_reopened():
+                    self.rebook()
+                super(Order, self).save(*args, **kwargs)
+                if is_open != was_open:
+                    OpenOrderCounter.adjust(1 if is_open else -1)
+                if was_open and self.status in self.RELEASED_ORDERS:
+                    self.release()
+                if status_changed:
+                    OrderStatusEvent.objects.create(order_id=self.pk, status=self.status, created_at=now)
+
+        self._loaded_status = self.status
+        self._capacity_reserved = False
+        if status_changed:
+            transaction.on_commit(partial(publish_order_status, self))
 
     @classmethod
+    @use_primary()
     def check_limit(cls):
         """
         check if the number of open order has reached the limit"
@@ -94,13 +213,185 @@ class Order(models.Model):
         IS_EXCEEDED = True
         NOT_EXCEEDED = False
 
-        limit = int(ConfigurationSettings.objects.get(constant='ORDER_LIMIT').value)
-        open_orders = Order.objects.filter(status__in=[cls.ORDER_PLACED, cls.ACCEPTED, cls.PROCESSING]).count()
+        limit = ConfigurationSettings.get_int('ORDER_LIMIT')
+        open_orders = OpenOrderCounter.get_open_orders()
 
         if open_orders >= limit:
             return IS_EXCEEDED
         return NOT_EXCEEDED
 
+    @staticmethod
+    def get_start_by(needed_at, prep_time_in_minutes):
+        """
+        Latest time the kitchen can start on an order and still have it ready when needed
+
+        Keyword arguments:
+        needed_at - scheduled time of the order, or when it was placed for as soon as possible
+        prep_time_in_minutes - sum of prep time x quantity over the dishes of the order
+        """
+        return needed_at - timedelta(minutes=prep_time_in_minutes)
+
+    def prepare_placement(self, order_dishes):
+        """
+        Set start_by and the totals of an order being placed and book its kitchen slot, returning False if the
+        slot is full. Every way of placing an order goes through this before saving it and through
+        record_placement once it is saved with its dishes.
+
+        Keyword arguments:
+        order_dishes - list of (dish id, dish name, prep time in minutes, quantity)
+        """
+        prep_time = sum(prep_time * quantity for dish_id, name, prep_time, quantity in order_dishes)
+        self.start_by = self.get_start_by(self.scheduled_time or self.created_at, prep_time)
+        self.set_totals(order_dishes)
+        return self.book_slot(prep_time)
+
+    @classmethod
+    def record_placement(cls, orders):
+        """
+        Bookkeeping of placed orders once they are saved with their dishes: the demand counts, and the status
+        events and notifications of the orders bulk created without Order.save
+
+        Keyword arguments:
+        orders - the placed orders
+        """
+        DishDemandCount.record(demand for order in orders for demand in order.get_demand())
+        bulk_created = [order for order in orders if order._loaded_status is None]
+        OrderStatusEvent.objects.bulk_create([
+            OrderStatusEvent(order_id=order.id, status=order.status, created_at=order.created_at)
+            for order in bulk_created
+        ])
+        for order in bulk_created:
+            order._loaded_status = order.status
+            transaction.on_commit(partial(publish_order_status, order))
+
+    def book_slot(self, prep_time_in_minutes):
+        """
+        Book the load of a scheduled order in the kitchen slot of its scheduled time, setting booked_slot
+        and booked_load. Returns False if the slot is full. Orders for as soon as possible are limited by
+        ORDER_LIMIT instead, and nothing is booked while SLOT_CAPACITY is not configured.
+
+        Keyword arguments:
+        prep_time_in_minutes - sum of prep time x quantity over the dishes of the order
+        """
+        if self.scheduled_time is None:
+            return True
+        try:
+            capacity = ConfigurationSettings.get_int('SLOT_CAPACITY')
+        except ConfigurationSettings.DoesNotExist:
+            return True
+
+        self.booked_slot = KitchenSlot.get_slot_start(self.scheduled_time)
+        self.booked_load = prep_time_in_minutes
+        return KitchenSlot.book(self.booked_slot, prep_time_in_minutes, capacity)
+
+    def set_totals(self, order_dishes):
+        """
+        Fill in total_items, total_prep_minutes and dish_summary
+
+        Keyword arguments:
+        order_dishes - list of (dish id, dish name, prep time in minutes, quantity)
+        """
+        self.total_items = sum(quantity for dish_id, name, prep_time, quantity in order_dishes)
+        self.total_prep_minutes = sum(prep_time * quantity for dish_id, name, prep_time, quantity in order_dishes)
+        self.dish_summary = json.dumps([[dish_id, name, quantity]
+                                        for dish_id, name, prep_time, quantity in order_dishes])
+
+    @classmethod
+    def get_order_dishes(cls, order_ids):
+        """
+        The (dish id, dish name, prep time in minutes, quantity) of the dishes of the orders, by order id
+
+        """
+        rows = OrderDishRelation.objects.filter(order_id__in=order_ids).order_by('id').values_list(
+            'order_id', 'dish_id', 'dish__dish_name', 'dish__prep_time_in_minutes', 'quantity')
+        order_dishes = {}
+        for order_id, dish_id, dish_name, prep_time, quantity in rows:
+            order_dishes.setdefault(order_id, []).append((dish_id, dish_name, prep_time, quantity))
+        return order_dishes
+
+    def update_totals(self):
+        """
+        Recompute the totals from the dishes saved for this order, e.g. after they were edited
+
+        """
+        self.set_totals(self.get_order_dishes([self.pk]).get(self.pk, []))
+        Order.objects.filter(pk=self.pk).update(total_items=self.total_items,
+                                                total_prep_minutes=self.total_prep_minutes,
+                                                dish_summary=self.dish_summary)
+
+    @classmethod
+    def add_missing_totals(cls, orders):
+        """
+        Set the totals of the orders placed before they existed and not backfilled yet, with a single query
+
+        """
+        pending = [order for order in orders if not order.dish_summary]
+        if pending:
+            order_dishes = cls.get_order_dishes([order.pk for order in pending])
+            for order in pending:
+                order.set_totals(order_dishes.get(order.pk, []))
+        return orders
+
+    def get_dishes(self):
+        """
+        Dishes of the order as dicts with the dish id, its name and quantity
+
+        """
+        if not self.dish_summary:
+            # placed before the totals existed and not backfilled yet, add_missing_totals does this for a list
+            return [{'dish': dish_id, 'name': name, 'quantity': quantity}
+                    for dish_id, name, prep_time, quantity in self.get_order_dishes([self.pk]).get(self.pk, [])]
+        return [{'dish': dish_id, 'name': name, 'quantity': quantity}
+                for dish_id, name, quantity in json.loads(self.dish_summary)]
+
+    def get_demand(self):
+        """
+        The dishes of the order as (dish id, time the order is needed at, quantity), as DishDemandCount counts them
+
+        """
+        needed_at = self.scheduled_time or self.created_at
+        return [(dish['dish'], needed_at, dish['quantity']) for dish in self.get_dishes()]
+
+    def is_reopened(self):
+        """
+        Whether the order is being moved back to open after it was cancelled or rejected
+
+        """
+        return not self._state.adding and self._loaded_status in self.RELEASED_ORDERS and \
+            self.status in self.OPEN_ORDERS
+
+    def rebook(self):
+        """
+        Book the kitchen slot and demand an order released when closed again, as it is reopened.
+        Raises ValidationError if the slot filled up meanwhile.
+
+        """
+        if self.booked_slot is not None:
+            load = self.booked_load
+            self.booked_slot, self.booked_load = None, 0
+            if not self.book_slot(load):
+                raise ValidationError(self.SLOT_FULL_ERROR.format(self.booked_slot))
+        DishDemandCount.record(self.get_demand())
+
+    def release(self):
+        """
+        Give back the kitchen slot of an order that will not be prepared and take it out of the demand counts
+
+        """
+        if self.booked_slot is not None:
+            KitchenSlot.release(self.booked_slot, self.booked_load)
+        DishDemandCount.release(self.get_demand())
+
+    @classmethod
+    def kitchen_queue(cls):
+        """
+        Open orders, the one the kitchen has to start on first coming first.
+        start_by is fixed when an order is placed and orders leave the queue by being closed,
+        so the queue is read in order straight from kitchen_queue_idx.
+
+        """
+        return Order.objects.filter(status__in=cls.OPEN_ORDERS).order_by('start_by', 'id')
+
     def cancel_order(self, user_id):
         """
         Cancel the order placed by the user and give appropriate error messages on failure
@@ -122,11 +413,38 @@ class Order(models.Model):
             return self.ORDER_CLOSED_ERROR
 
     @classmethod
+    @use_primary()
     def place_order(cls, scheduled_time, logged_in_user, order_dish_relation_set):
+        """
+        Admit the order against ORDER_LIMIT and create it along with its dishes
+
+        Raises ValidationError when the order is scheduled in the past, the limit has been reached or
+        the kitchen slot is full.
+
+        Keyword arguments:
+        scheduled_time - time the order is scheduled for, None for as soon as possible
+        logged_in_user - user placing the order
+        order_dish_relation_set - list of dicts with the dish and its quantity
+        """
+        if scheduled_time is not None and scheduled_time < timezone.now():
+            raise ValidationError(cls.PAST_DATE_ERROR)
+
+        limit = ConfigurationSettings.get_int('ORDER_LIMIT')
         try:
             with transaction.atomic():
-                order = Order.objects.create(placed_by=logged_in_user, scheduled_time=scheduled_time,
-                                             created_at=timezone.now(), closed_at=None)
+                if not OpenOrderCounter.reserve(limit):
+                    raise ValidationError(cls.HEAVY_TRAFFIC_ERROR)
+
+                order = Order(placed_by=logged_in_user, scheduled_time=scheduled_time,
+                              created_at=timezone.now(), closed_at=None)
+                if not order.prepare_placement([
+                    (od_obj['dish'].id, od_obj['dish'].dish_name, od_obj['dish'].prep_time_in_minutes,
+                     od_obj['quantity'])
+                    for od_obj in order_dish_relation_set
+                ]):
+                    raise ValidationError(cls.SLOT_FULL_ERROR.format(order.booked_slot))
+                order._capacity_reserved = True
+                order.save()
 
                 order_dish_objects = [
                     OrderDishRelation(order_id=order.id, dish_id=od_obj['dish'].id, quantity=od_obj['quantity'])
@@ -134,11 +452,130 @@ class Order(models.Model):
                 ]
 
                 OrderDishRelation.objects.bulk_create(order_dish_objects)
+                cls.record_placement([order])
         except DatabaseError:
             logging.exception("message")
         else:
             return order
 
+    @classmethod
+    def place_orders(cls, logged_in_user, orders):
+        """
+        Place a batch of orders of the user in a single transaction, all of them or none if they do not fit
+        within ORDER_LIMIT. See place_order_batch.
+
+        Keyword arguments:
+        logged_in_user - user placing the orders
+        orders - list of dicts with scheduled_time and dishes, a list of dicts with the dish id and quantity
+        """
+        return cls.place_order_batch([dict(order, placed_by_id=logged_in_user.id) for order in orders])
+
+    @classmethod
+    @use_primary()
+    def place_order_batch(cls, orders, admit_partially=False):
+        """
+        Place a batch of orders in a single transaction.
+        Dishes are validated with one query and capacity is reserved once for all valid orders.
+        Returns one dict per order, holding either the placed 'order' or its 'errors'.
+
+        Keyword arguments:
+        orders - list of dicts with placed_by_id, scheduled_time and dishes, a list of dicts with the dish id
+                 and quantity
+        admit_partially - when the valid orders do not all fit within ORDER_LIMIT, place the first ones that fit
+                          instead of none of them
+        """
+        dish_ids = {dish['dish'] for order in orders for dish in order['dishes']}
+        prep_times = {}
+        dish_names = {}
+        for dish_id, prep_time, dish_name in Dish.objects.filter(id__in=dish_ids, is_available=True).values_list(
+                'id', 'prep_time_in_minutes', 'dish_name'):
+            prep_times[dish_id] = prep_time
+            dish_names[dish_id] = dish_name
+
+        results = []
+        valid_orders = []
+        now = timezone.now()
+        for order_data in orders:
+            errors = []
+            order_dish_ids = [dish['dish'] for dish in order_data['dishes']]
+            scheduled_time = order_data.get('scheduled_time')
+            if not order_dish_ids:
+                errors.append('Order at least one dish')
+            if len(set(order_dish_ids)) != len(order_dish_ids):
+                errors.append('A dish can be ordered only once per order')
+            unavailable = [dish_id for dish_id in order_dish_ids if dish_id not in prep_times]
+            if unavailable:
+                errors.append('Dishes not available: {0}'.format(', '.join(str(dish_id) for dish_id in unavailable)))
+            if scheduled_time is not None and scheduled_time < now:
+                errors.append(cls.PAST_DATE_ERROR)
+
+            result = {'order': None, 'errors': errors}
+            results.append(result)
+            if not errors:
+                valid_orders.append((result, order_data))
+
+        if not valid_orders:
+            return results
+
+        limit = ConfigurationSettings.get_int('ORDER_LIMIT')
+        heavy_traffic = 'Due to heavy traffic, Squad Pantry can not accept your orders.'
+        try:
+            with transaction.atomic():
+                placed_orders = []
+                booked_orders = []
+                for result, order_data in valid_orders:
+                    order = Order(placed_by_id=order_data['placed_by_id'],
+                                  scheduled_time=order_data.get('scheduled_time'), created_at=now, closed_at=None)
+                    if order.prepare_placement([
+                        (dish['dish'], dish_names[dish['dish']], prep_times[dish['dish']], dish['quantity'])
+                        for dish in order_data['dishes']
+                    ]):
+                        placed_orders.append(order)
+                        booked_orders.append((result, order_data))
+                    else:
+                        result['errors'] = [cls.SLOT_FULL_ERROR.format(order.booked_slot)]
+                valid_orders = booked_orders
+                if not valid_orders:
+                    return results
+
+                if admit_partially:
+                    admitted = OpenOrderCounter.reserve_up_to(limit, len(valid_orders))
+                    for order, (result, order_data) in zip(placed_orders[admitted:], valid_orders[admitted:]):
+                        if order.booked_slot is not None:
+                            KitchenSlot.release(order.booked_slot, order.booked_load)
+                        result['errors'] = [heavy_traffic]
+                    valid_orders = valid_orders[:admitted]
+                    placed_orders = placed_orders[:admitted]
+                    if not valid_orders:
+                        return results
+                elif not OpenOrderCounter.reserve(limit, len(valid_orders)):
+                    raise ValidationError(heavy_traffic)
+
+                if connection.features.can_return_ids_from_bulk_insert:
+                    Order.objects.bulk_create(placed_orders)
+                else:
+                    for order in placed_orders:
+                        order._capacity_reserved = True
+                        order.save()
+
+                OrderDishRelation.objects.bulk_create([
+                    OrderDishRelation(order_id=order.id, dish_id=dish['dish'], quantity=dish['quantity'])
+                    for order, (result, order_data) in zip(placed_orders, valid_orders)
+                    for dish in order_data['dishes']
+                ])
+                cls.record_placement(placed_orders)
+        except ValidationError as error:
+            for result, order_data in valid_orders:
+                result['errors'] = error.messages
+        except DatabaseError:
+            logging.exception("message")
+            for result, order_data in valid_orders:
+                result['errors'] = ['Could not place the order']
+        else:
+            for order, (result, order_data) in zip(placed_orders, valid_orders):
+                result['order'] = order
+        return results
+
 
 class OrderDishRelation(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
@@ -149,84 +586,893 @@ class OrderDishRelation(models.Model):
         unique_together = ["order", "dish"]
 
 
+@contextmanager
+def skip_order_totals():
+    """
+    Leave the totals of the orders alone when their dishes are saved or deleted inside the block,
+    e.g. when the orders are deleted along with them
+    """
+    _local.skip_order_totals = getattr(_local, 'skip_order_totals', 0) + 1
+    try:
+        yield
+    finally:
+        _local.skip_order_totals -= 1
+
+
+@receiver(post_save, sender=OrderDishRelation)
+@receiver(post_delete, sender=OrderDishRelation)
+def update_order_totals(sender, instance, **kwargs):
+    if getattr(_local, 'skip_order_totals', 0):
+        return
+    Order(pk=instance.order_id).update_totals()
+
+
+class OrderStatusEvent(models.Model):
+    """
+    Append-only log of the statuses each order went through, with the time of the transition
+    """
+    # no database constraint, events are kept when their order is deleted
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                              related_name='status_events')
+    status = models.IntegerField(choices=Order.STATUS)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='status_event_created_at_idx'),
+            models.Index(fields=['order', 'created_at'], name='status_event_order_idx'),
+        ]
+
+    def __str__(self):
+        return "{0} {1}".format(self.order_id, self.get_status_display())
+
+
+class OpenOrderCounter(models.Model):
+    """
+    Single row holding the number of open orders, so admission control does not have to count them
+    """
+    SINGLETON_ID = 1
+
+    open_orders = models.IntegerField(default=0)
+
+    @classmethod
+    def get_open_orders(cls):
+        open_orders = cls.objects.filter(pk=cls.SINGLETON_ID).values_list('open_orders', flat=True).first()
+        if open_orders is None:
+            return cls.rebuild().open_orders
+        return open_orders
+
+    @classmethod
+    def reserve(cls, limit, count=1):
+        """
+        Atomically take count slots if that keeps the open orders within the limit.
+        Returns True if the slots were reserved.
+
+        Keyword arguments:
+        limit - maximum number of open orders
+        count - number of orders to admit
+        """
+        reserved = cls.objects.filter(pk=cls.SINGLETON_ID, open_orders__lte=limit - count).update(
+            open_orders=F('open_orders') + count)
+        if not reserved and not cls.objects.filter(pk=cls.SINGLETON_ID).exists():
+            cls.rebuild()
+            reserved = cls.objects.filter(pk=cls.SINGLETON_ID, open_orders__lte=limit - count).update(
+                open_orders=F('open_orders') + count)
+        return bool(reserved)
+
+    @classmethod
+    def reserve_up_to(cls, limit, count):
+        """
+        Atomically take as many of count slots as the limit allows, returning the number taken
+
+        Keyword arguments:
+        limit - maximum number of open orders
+        count - number of orders waiting to be admitted
+        """
+        with transaction.atomic():
+            open_orders = cls.objects.select_for_update().filter(pk=cls.SINGLETON_ID).values_list(
+                'open_orders', flat=True).first()
+            if open_orders is None:
+                open_orders = cls.rebuild().open_orders
+            reserved = max(0, min(count, limit - open_orders))
+            if reserved:
+                cls.objects.filter(pk=cls.SINGLETON_ID).update(open_orders=F('open_orders') + reserved)
+        return reserved
+
+    @classmethod
+    def adjust(cls, delta):
+        """
+        Add delta to the open orders, e.g. -1 when an order gets closed
+
+        Keyword arguments:
+        delta - change in the number of open orders
+        """
+        if not cls.objects.filter(pk=cls.SINGLETON_ID).update(open_orders=F('open_orders') + delta):
+            # the order has already been written, so a rebuilt counter includes it
+            cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recount the open orders, e.g. after orders were changed with queryset updates
+
+        """
+        open_orders = Order.objects.filter(status__in=Order.OPEN_ORDERS).count()
+        counter, created = cls.objects.get_or_create(pk=cls.SINGLETON_ID, defaults={'open_orders': open_orders})
+        if not created and counter.open_orders != open_orders:
+            counter.open_orders = open_orders
+            counter.save(update_fields=['open_orders'])
+        return counter
+
+
+class KitchenSlot(models.Model):
+    """
+    Prep minutes booked by scheduled orders in a slot of the kitchen, so checking a slot is a single row lookup
+    """
+    SLOT_MINUTES = 30
+
+    slot_start = models.DateTimeField(unique=True)
+    load = models.IntegerField(default=0)
+
+    @classmethod
+    def get_slot_start(cls, value):
+        return floor_time(value, timedelta(minutes=cls.SLOT_MINUTES))
+
+    @classmethod
+    def book(cls, slot_start, load, capacity):
+        """
+        Atomically add load to the slot if it stays within capacity. Returns True if it was booked.
+
+        Keyword arguments:
+        slot_start - start of the slot
+        load - prep minutes to book
+        capacity - prep minutes the kitchen can take in a slot, SLOT_CAPACITY
+        """
+        slots = cls.objects.filter(slot_start=slot_start)
+        if slots.filter(load__lte=capacity - load).update(load=F('load') + load):
+            return True
+        if load > capacity or slots.exists():
+            return False
+        try:
+            with transaction.atomic():
+                cls.objects.create(slot_start=slot_start, load=load)
+            return True
+        except IntegrityError:
+            # booked meanwhile by another order
+            return bool(slots.filter(load__lte=capacity - load).update(load=F('load') + load))
+
+    @classmethod
+    def release(cls, slot_start, load):
+        cls.objects.filter(slot_start=slot_start).update(load=F('load') - load)
+
+    @classmethod
+    def get_available(cls, slot_start):
+        """
+        Prep minutes still available in the slot, None while SLOT_CAPACITY is not configured
+
+        """
+        try:
+            capacity = ConfigurationSettings.get_int('SLOT_CAPACITY')
+        except ConfigurationSettings.DoesNotExist:
+            return None
+        return capacity - (cls.objects.filter(slot_start=slot_start).values_list('load', flat=True).first() or 0)
+
+    @classmethod
+    def get_available_slots(cls, start, end):
+        """
+        Slots starting in [start, end) with the prep minutes still available in each of them, as a list of
+        (slot start, available minutes)
+
+        Keyword arguments:
+        start - slots starting from this time are listed, it is rounded up to the next slot
+        end - slots starting before this time are listed
+        """
+        capacity = ConfigurationSettings.get_int('SLOT_CAPACITY')
+        size = timedelta(minutes=cls.SLOT_MINUTES)
+        first_slot = cls.get_slot_start(start)
+        if first_slot < start:
+            first_slot += size
+        loads = dict(cls.objects.filter(slot_start__gte=first_slot, slot_start__lt=end).values_list(
+            'slot_start', 'load'))
+
+        slots = []
+        slot_start = first_slot
+        while slot_start < end:
+            slots.append((slot_start, max(0, capacity - loads.get(slot_start, 0))))
+            slot_start += size
+        return slots
+
+
+class OrderRequest(models.Model):
+    """
+    Order waiting to be placed by the place_pending_orders task, identified to the client by its handle
+    """
+    PENDING = 0
+    PLACED = 1
+    FAILED = 2
+    STATUS = (
+        (PENDING, 'Pending'),
+        (PLACED, 'Placed'),
+        (FAILED, 'Failed'),
+    )
+
+    handle = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    placed_by = models.ForeignKey(SquadUser, on_delete=models.CASCADE, db_index=False)
+    status = models.IntegerField(choices=STATUS, default=PENDING)
+    # scheduled_time and dishes of the order, as JSON
+    payload = models.TextField()
+    # the order keeps its id once archived, so it is not a database constraint
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                              blank=True, null=True)
+    errors = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # the queue, oldest first
+            models.Index(fields=['status', 'id'], name='order_request_status_idx'),
+        ]
+
+    @staticmethod
+    def dump_order(order_data):
+        return json.dumps({
+            'scheduled_time': order_data['scheduled_time'].isoformat() if order_data.get('scheduled_time') else None,
+            'dishes': [{'dish': dish['dish'], 'quantity': dish['quantity']} for dish in order_data['dishes']],
+        })
+
+    def get_order_data(self):
+        order_data = json.loads(self.payload)
+        if order_data['scheduled_time']:
+            order_data['scheduled_time'] = parse_datetime(order_data['scheduled_time'])
+        order_data['placed_by_id'] = self.placed_by_id
+        return order_data
+
+    def get_errors(self):
+        return json.loads(self.errors) if self.errors else []
+
+    @classmethod
+    def place_pending(cls, batch_size):
+        """
+        Place up to batch_size pending requests, oldest first, with one Order.place_order_batch.
+        Requests are admitted in order until ORDER_LIMIT is reached, the others fail.
+        Returns the number of requests processed.
+
+        Keyword arguments:
+        batch_size - maximum number of requests placed in the transaction
+        """
+        with transaction.atomic():
+            order_requests = list(cls.objects.select_for_update(skip_locked=True).filter(
+                status=cls.PENDING).order_by('id')[:batch_size])
+            if not order_requests:
+                return 0
+
+            results = Order.place_order_batch([order_request.get_order_data() for order_request in order_requests],
+                                              admit_partially=True)
+            for order_request, result in zip(order_requests, results):
+                if result['order'] is not None:
+                    order_request.status = cls.PLACED
+                    order_request.order_id = result['order'].id
+                else:
+                    order_request.status = cls.FAILED
+                    order_request.errors = json.dumps(result['errors'])
+
+            # one UPDATE for the whole batch
+            cls.objects.filter(id__in=[order_request.id for order_request in order_requests]).update(
+                status=Case(*[When(id=order_request.id, then=Value(order_request.status))
+                              for order_request in order_requests], output_field=models.IntegerField()),
+                order_id=Case(*[When(id=order_request.id, then=Value(order_request.order_id))
+                                for order_request in order_requests if order_request.order_id is not None],
+                              default=None, output_field=models.IntegerField()),
+                errors=Case(*[When(id=order_request.id, then=Value(order_request.errors))
+                              for order_request in order_requests if order_request.errors],
+                            default=Value(''), output_field=models.TextField()),
+                processed_at=timezone.now(),
+            )
+        return len(order_requests)
+
+
+class ArchivedOrder(models.Model):
+    """
+    Closed order moved out of Order once older than ARCHIVE_AFTER_DAYS, keeping its id
+    """
+    # fields read for the order history, shared by Order and ArchivedOrder
+    HISTORY_FIELDS = ('id', 'placed_by_id', 'status', 'scheduled_time', 'created_at', 'closed_at', 'accepted_at',
+                      'start_by')
+
+    id = models.IntegerField(primary_key=True)
+    placed_by = models.ForeignKey(SquadUser, on_delete=models.CASCADE, db_index=False)
+    status = models.IntegerField(choices=Order.STATUS)
+    scheduled_time = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    closed_at = models.DateTimeField(blank=True, null=True)
+    accepted_at = models.DateTimeField(blank=True, null=True)
+    start_by = models.DateTimeField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['placed_by', '-created_at'], name='archived_placed_by_idx'),
+        ]
+
+    @classmethod
+    def archive_batch(cls, closed_before, batch_size):
+        """
+        Move up to batch_size orders closed before closed_before, with their dishes, to the archive
+        in one transaction. Returns the number of orders moved.
+
+        Keyword arguments:
+        closed_before - orders closed before this time are archived
+        batch_size - maximum number of orders moved
+        """
+        with transaction.atomic():
+            order_ids = list(Order.objects.filter(status__in=Order.CLOSED_ORDERS, closed_at__lt=closed_before)
+                             .order_by('closed_at').values_list('id', flat=True)[:batch_size])
+            if not order_ids:
+                return 0
+
+            cls.objects.bulk_create([
+                cls(**order) for order in Order.objects.filter(id__in=order_ids).values(*cls.HISTORY_FIELDS)
+            ])
+            ArchivedOrderDishRelation.objects.bulk_create([
+                ArchivedOrderDishRelation(**order_dish) for order_dish in OrderDishRelation.objects.filter(
+                    order_id__in=order_ids).values('order_id', 'dish_id', 'quantity')
+            ])
+            # the dishes are deleted through the cascade, along with their orders, whose totals need no update
+            with skip_order_totals():
+                Order.objects.filter(id__in=order_ids).delete()
+        return len(order_ids)
+
+    @classmethod
+    def get_order_history(cls, user):
+        """
+        Orders of the user, live and archived, newest first, as dicts of HISTORY_FIELDS and 'archived'
+
+        """
+        live = Order.objects.filter(placed_by=user).values(*cls.HISTORY_FIELDS).annotate(
+            archived=models.Value(False, output_field=models.BooleanField()))
+        archived = cls.objects.filter(placed_by=user).values(*cls.HISTORY_FIELDS).annotate(
+            archived=models.Value(True, output_field=models.BooleanField()))
+        return live.union(archived, all=True).order_by('-created_at', '-id')
+
+    @staticmethod
+    def add_dishes(orders):
+        """
+        Set the 'dishes' of order history dicts, with two queries whatever the number of orders
+
+        """
+        live_ids = [order['id'] for order in orders if not order['archived']]
+        archived_ids = [order['id'] for order in orders if order['archived']]
+        dishes = {}
+        for model, order_ids in [(OrderDishRelation, live_ids), (ArchivedOrderDishRelation, archived_ids)]:
+            if not order_ids:
+                continue
+            order_dishes = model.objects.filter(order_id__in=order_ids).values_list(
+                'order_id', 'dish_id', 'dish__dish_name', 'quantity')
+            for order_id, dish_id, dish_name, quantity in order_dishes:
+                dishes.setdefault(order_id, []).append({'dish': dish_id, 'name': dish_name, 'quantity': quantity})
+        for order in orders:
+            order['dishes'] = dishes.get(order['id'], [])
+        return orders
+
+
+class ArchivedOrderDishRelation(models.Model):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE)
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+
+
+@receiver(post_delete, sender=Order)
+def release_deleted_order(sender, instance, **kwargs):
+    if instance.status in Order.OPEN_ORDERS:
+        OpenOrderCounter.adjust(-1)
+        instance.release()
+
+
 class ConfigurationSettings(models.Model):
     constant = models.CharField(max_length=256, unique=True)
     value = models.CharField(max_length=256)
 
+    # process-local cache of constant -> (value, expires_at)
+    _cache = {}
+    # cached value of a constant that is not set
+    _MISSING = object()
+
     def __str__(self):
         return self.constant
 
+    @classmethod
+    def get_value(cls, constant):
+        """
+        Get the value of a setting, cached in this process for CONFIGURATION_SETTINGS_CACHE_TTL seconds.
+        Raises ConfigurationSettings.DoesNotExist if the setting is not set, which is cached as well.
+
+        Keyword arguments:
+        constant - name of the setting
+        """
+        now = time.monotonic()
+        cached = cls._cache.get(constant)
+        if cached is None or cached[1] <= now:
+            try:
+                value = cls.objects.get(constant=constant).value
+            except cls.DoesNotExist:
+                # optional settings such as SLOT_CAPACITY are looked up on every order
+                value = cls._MISSING
+            cached = (value, now + settings.CONFIGURATION_SETTINGS_CACHE_TTL)
+            cls._cache[constant] = cached
+
+        if cached[0] is cls._MISSING:
+            raise cls.DoesNotExist('ConfigurationSettings {0} is not set.'.format(constant))
+        return cached[0]
+
+    @classmethod
+    def get_int(cls, constant):
+        return int(cls.get_value(constant))
+
+    @classmethod
+    def invalidate(cls, constant=None):
+        """
+        Drop a cached setting, or every cached setting when no constant is given
+
+        """
+        if constant is None:
+            cls._cache.clear()
+        else:
+            cls._cache.pop(constant, None)
+
+
+@receiver(post_save, sender=ConfigurationSettings)
+@receiver(post_delete, sender=ConfigurationSettings)
+def invalidate_configuration_settings(sender, instance, **kwargs):
+    ConfigurationSettings.invalidate(instance.constant)
+
+
+def turnaround_time():
+    return ExpressionWrapper(F('closed_at') - F('created_at'), output_field=models.DurationField())
+
+
+def floor_time(value, size):
+    """
+    Start of the bucket of the given size containing value, buckets being aligned on the epoch
+
+    """
+    return EPOCH + (value - EPOCH) // size * size
+
 
 class PerformanceMetrics(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, unique=True)
     average_throughput = models.IntegerField(editable=False)
     average_turnaround_time = models.DurationField(editable=False)
+    window_start = models.DateTimeField(blank=True, null=True, editable=False, unique=True,
+                                        help_text='Orders closed after this time are included in the metrics')
+    window_end = models.DateTimeField(blank=True, null=True, editable=False,
+                                      help_text='Orders closed up to this time are included in the metrics')
+
+    LOCK_NAME = 'squad_pantry_app:performance_metrics'
 
     @classmethod
-    def calculate_avg_performance_metrics(cls):
+    def get_watermark(cls):
         """
-        Calculate the performance metrics as per scheduled, from last entered entry in database to now.
+        Return the closed_at watermark up to which delivered orders have already been aggregated,
+        or None if metrics were never calculated.
 
         """
-        try:
-            latest_record = PerformanceMetrics.objects.latest('id')
-        except PerformanceMetrics.DoesNotExists:
-            completed_orders_curr_range = Order.objects.filter(
-                status=Order.DELIVERED
-            )
-        else:
-            start_date_time = latest_record.created_at
-            completed_orders_curr_range = Order.objects.filter(
-                status=Order.DELIVERED,
-                created_at__range=(start_date_time, timezone.now())
-            )
-        finally:
-            throughput = len(completed_orders_curr_range)
+        latest_record = PerformanceMetrics.objects.order_by('-id').values_list('window_end', 'created_at').first()
+        if latest_record is None:
+            return None
+        window_end, created_at = latest_record
+        # records written before the watermark existed only know when they were created
+        return window_end or created_at
+
+    @staticmethod
+    def get_delivered_orders(window_start, window_end):
+        """
+        Orders delivered in the window (window_start, window_end]
+
+        Keyword arguments:
+        window_start - Exclusive lower bound of closed_at, None for no lower bound
+        window_end - Inclusive upper bound of closed_at
+        """
+        delivered_orders = Order.objects.filter(status=Order.DELIVERED, closed_at__lte=window_end)
+        if window_start is not None:
+            delivered_orders = delivered_orders.filter(closed_at__gt=window_start)
+        return delivered_orders
+
+    @classmethod
+    def calculate_avg_performance_metrics(cls, window_end=None):
+        """
+        Calculate the performance metrics for orders delivered after the watermark, up to window_end.
+
+        Keyword arguments:
+        window_end - Upper bound of closed_at for this run. Defaults to now
+        """
+        if window_end is None:
+            window_end = timezone.now()
+
+        completed_orders_curr_range = cls.get_delivered_orders(cls.get_watermark(), window_end)
+        metrics = completed_orders_curr_range.aggregate(
+            throughput=Count('id'),
+            average_turnaround_time=Avg(turnaround_time())
+        )
+        throughput = metrics['throughput']
 
         if throughput == 0:
             average_turnaround_time = timedelta(seconds=0)
             return average_turnaround_time, throughput
 
-        total_turnaround_time = 0
-        for obj in completed_orders_curr_range:
-            total_turnaround_time += (obj.closed_at - obj.created_at).total_seconds()
+        return metrics['average_turnaround_time'], throughput
+
+    @classmethod
+    def create_avg_performance_metrics(cls, min_window=None):
+        """
+        Insert the metrics of the orders delivered since the watermark into Database and advance the watermark.
+        Runs hold a lock, a run that can not take it is skipped, and the (window_start, window_end] window is
+        stored with the record, so no window is ever counted twice. Windows end METRICS_WINDOW_LAG seconds in the
+        past, so orders still being delivered are counted in the next one. However many runs were missed,
+        the next one catches up in a single window.
+        Returns the new record, or None if the run was skipped.
+
+        Keyword arguments:
+        min_window - skip the run if less time than this has passed since the watermark, e.g. when runs
+                     queued up while workers were down
+        """
+        window_end = timezone.now() - timedelta(seconds=settings.METRICS_WINDOW_LAG)
+        with transaction.atomic():
+            with try_lock(cls.LOCK_NAME) as acquired:
+                if not acquired:
+                    logging.info('Performance metrics are already being calculated, skipping')
+                    return None
+
+                window_start = PerformanceMetrics.get_watermark()
+                if window_start is not None and min_window is not None and window_end - window_start < min_window:
+                    return None
 
-        average_turnaround_time = total_turnaround_time/throughput
-        return timedelta(seconds=average_turnaround_time), throughput
+                MetricsRollup.record_window(window_start, window_end)
+                turnaround_time, throughput = PerformanceMetrics.calculate_avg_performance_metrics(window_end)
+                return PerformanceMetrics.objects.create(average_throughput=throughput,
+                                                         average_turnaround_time=turnaround_time,
+                                                         window_start=window_start, window_end=window_end)
+
+    @staticmethod
+    def get_date_range(start_date, end_date):
+        """
+        Turn dates into the range [start of start_date, end of end_date)
+
+        """
+        start = datetime.combine(parse_date(str(start_date)), datetime.min.time()).replace(tzinfo=timezone.utc)
+        end = datetime.combine(parse_date(str(end_date)), datetime.min.time()).replace(tzinfo=timezone.utc)
+        return start, end + timedelta(days=1)
 
     @classmethod
-    def create_avg_performance_metrics(cls):
+    def get_percentiles(cls, start_date, end_date):
         """
-        Insert the calculated metrics into Database
+        Get the p50, p90 and p99 of the turnaround, queue wait and delivery times for the given dates,
+        as a list of (metric name, durations as strings)
 
+        Keyword arguments:
+        start_date - Metrics needed from this date
+        end_date - Metrics needed till this date, included
         """
-        turnaround_time, throughput = PerformanceMetrics.calculate_avg_performance_metrics()
-        PerformanceMetrics.objects.create(average_throughput=throughput, average_turnaround_time=turnaround_time)
+        sketches = MetricsRollup.get_sketches(*cls.get_date_range(start_date, end_date))
+        percentiles = []
+        for name in MetricsRollup.SKETCHES:
+            sketch = sketches[name]
+            durations = [
+                str(timedelta(seconds=round(sketch.quantile(percentile / 100.0)))) if sketch.count else '-'
+                for percentile in MetricsRollup.PERCENTILES
+            ]
+            percentiles.append((MetricsRollup._meta.get_field(name).verbose_name, durations))
+        return percentiles
 
     @classmethod
     def get_metrics_data(cls, start_date, end_date):
         """
-        Get average metrics for the given interval
+        Get the number of orders delivered and their average turnaround time for the given dates
 
         Keyword arguments:
         start_date - Metrics needed from this date
-        end_date - Metrics needed till this date
+        end_date - Metrics needed till this date, included
         """
-        metrics = PerformanceMetrics.objects.filter(created_at__range=(start_date, end_date))
-        num_metric_records = len(metrics)
-        total_metrics = metrics.aggregate(total_throughput=Sum('average_throughput'),
-                                          total_turnaround_time=Sum('average_turnaround_time'))
-
-        total_throughput = total_metrics['total_throughput']
-        total_turnaround_time = total_metrics['total_turnaround_time'].total_seconds()
+        start, end = cls.get_date_range(start_date, end_date)
+        throughput, total_turnaround_time = MetricsRollup.get_totals(start, end)
 
-        if total_throughput == 0:
+        if throughput == 0:
             average_turnaround_time = str(timedelta(seconds=0))
-            return total_throughput, average_turnaround_time
-        throughput = total_throughput/num_metric_records
-        turnaround_time = total_turnaround_time/num_metric_records
+            return throughput, average_turnaround_time
 
-        return throughput, str(timedelta(seconds=turnaround_time))
+        return throughput, str(total_turnaround_time / throughput)
 
     def __str__(self):
         return str(self.created_at)
+
+
+class MetricsRollup(models.Model):
+    """
+    Number of delivered orders and their total turnaround time per minute, hour and day of closed_at.
+    Sums and counts are stored rather than averages so that buckets can be added up for any range.
+    """
+    MINUTE = 0
+    HOUR = 1
+    DAY = 2
+
+    GRANULARITY = (
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+    # coarsest first
+    BUCKET_SIZES = (
+        (DAY, timedelta(days=1)),
+        (HOUR, timedelta(hours=1)),
+        (MINUTE, timedelta(minutes=1)),
+    )
+
+    # QuantileSketch fields, of durations in seconds
+    SKETCHES = ('turnaround_sketch', 'queue_wait_sketch', 'delivery_sketch')
+    PERCENTILES = (50, 90, 99)
+
+    granularity = models.IntegerField(choices=GRANULARITY)
+    bucket_start = models.DateTimeField()
+    throughput = models.IntegerField(default=0)
+    total_turnaround_time = models.DurationField(default=timedelta(0))
+    turnaround_sketch = models.TextField('Turnaround (placed to delivered)', blank=True, default='')
+    queue_wait_sketch = models.TextField('Queue wait (placed to accepted)', blank=True, default='')
+    delivery_sketch = models.TextField('Delivery (accepted to delivered)', blank=True, default='')
+
+    class Meta:
+        unique_together = ["granularity", "bucket_start"]
+
+    @classmethod
+    def record_window(cls, window_start, window_end):
+        """
+        Add the orders delivered in (window_start, window_end] to their minute, hour and day buckets
+
+        Keyword arguments:
+        window_start - Exclusive lower bound of closed_at, None for no lower bound
+        window_end - Inclusive upper bound of closed_at
+        """
+        delivered_orders = PerformanceMetrics.get_delivered_orders(window_start, window_end).annotate(
+            minute=TruncMinute('closed_at', tzinfo=timezone.utc)
+        )
+        per_minute = delivered_orders.values('minute').annotate(throughput=Count('id'),
+                                                                total_turnaround_time=Sum(turnaround_time()))
+
+        buckets = {}
+        for minute in per_minute:
+            for granularity, size in cls.BUCKET_SIZES:
+                key = (granularity, floor_time(minute['minute'], size))
+                if key not in buckets:
+                    buckets[key] = {'throughput': 0, 'total_turnaround_time': timedelta(0),
+                                    'sketches': {name: QuantileSketch() for name in cls.SKETCHES}}
+                buckets[key]['throughput'] += minute['throughput']
+                buckets[key]['total_turnaround_time'] += minute['total_turnaround_time']
+        if not buckets:
+            return
+
+        # percentiles need every duration, the database computes them and each one is added to its minute
+        # sketch only, hour and day sketches are merged from the minute ones
+        durations = delivered_orders.annotate(
+            turnaround=turnaround_time(),
+            queue_wait=ExpressionWrapper(F('accepted_at') - F('created_at'), output_field=models.DurationField()),
+            delivery=ExpressionWrapper(F('closed_at') - F('accepted_at'), output_field=models.DurationField()),
+        ).values_list('minute', 'turnaround', 'queue_wait', 'delivery')
+        for minute, *values in durations.iterator():
+            sketches = buckets[(cls.MINUTE, minute)]['sketches']
+            for name, value in zip(cls.SKETCHES, values):
+                if value is not None:
+                    sketches[name].add(value.total_seconds())
+        for (minute_granularity, minute), minute_bucket in list(buckets.items()):
+            if minute_granularity != cls.MINUTE:
+                continue
+            for granularity, size in cls.BUCKET_SIZES:
+                if granularity != cls.MINUTE:
+                    for name, sketch in minute_bucket['sketches'].items():
+                        buckets[(granularity, floor_time(minute, size))]['sketches'][name].merge(sketch)
+
+        # lock the buckets of this window with one range per granularity, a single time range would also take
+        # every finer bucket of the day, and one term per bucket grows with the length of the window
+        existing = Q(pk__in=[])
+        for granularity, size in cls.BUCKET_SIZES:
+            bucket_starts = [bucket_start for key, bucket_start in buckets if key == granularity]
+            existing |= Q(granularity=granularity, bucket_start__gte=min(bucket_starts),
+                          bucket_start__lte=max(bucket_starts))
+        existing = {(rollup.granularity, rollup.bucket_start): rollup
+                    for rollup in cls.objects.select_for_update().filter(existing)}
+
+        new_rollups = []
+        for key, bucket in buckets.items():
+            rollup = existing.get(key) or cls(granularity=key[0], bucket_start=key[1])
+            rollup.throughput += bucket['throughput']
+            rollup.total_turnaround_time += bucket['total_turnaround_time']
+            for name, sketch in bucket['sketches'].items():
+                sketch.merge(QuantileSketch.from_json(getattr(rollup, name)))
+                setattr(rollup, name, sketch.to_json())
+            if rollup.pk is None:
+                new_rollups.append(rollup)
+            else:
+                rollup.save()
+        cls.objects.bulk_create(new_rollups)
+
+    @classmethod
+    def get_covering_buckets(cls, start, end, bucket_sizes=None):
+        """
+        Split [start, end) into the fewest buckets, as a list of (granularity, first bucket start, end)
+
+        Keyword arguments:
+        start - Start of the range, aligned on a minute
+        end - End of the range, aligned on a minute
+        """
+        if bucket_sizes is None:
+            bucket_sizes = cls.BUCKET_SIZES
+        if start >= end:
+            return []
+
+        granularity, size = bucket_sizes[0]
+        if len(bucket_sizes) == 1:
+            return [(granularity, start, end)]
+
+        first_bucket = floor_time(start, size)
+        if first_bucket < start:
+            first_bucket += size
+        last_bucket = floor_time(end, size)
+        if first_bucket >= last_bucket:
+            return cls.get_covering_buckets(start, end, bucket_sizes[1:])
+
+        return (cls.get_covering_buckets(start, first_bucket, bucket_sizes[1:]) +
+                [(granularity, first_bucket, last_bucket)] +
+                cls.get_covering_buckets(last_bucket, end, bucket_sizes[1:]))
+
+    @classmethod
+    def get_covering_rollups(cls, start, end):
+        covering = Q(pk__in=[])
+        for granularity, first_bucket, last_bucket in cls.get_covering_buckets(start, end):
+            covering |= Q(granularity=granularity, bucket_start__gte=first_bucket, bucket_start__lt=last_bucket)
+        return cls.objects.filter(covering)
+
+    @classmethod
+    def get_sketches(cls, start, end):
+        """
+        Merge the sketches of the coarsest buckets covering [start, end), as a dict of sketch field -> sketch
+
+        Keyword arguments:
+        start - Start of the range, aligned on a minute
+        end - End of the range, aligned on a minute
+        """
+        sketches = {name: QuantileSketch() for name in cls.SKETCHES}
+        for rollup in cls.get_covering_rollups(start, end).values_list(*cls.SKETCHES):
+            for name, data in zip(cls.SKETCHES, rollup):
+                sketches[name].merge(QuantileSketch.from_json(data))
+        return sketches
+
+    @classmethod
+    def get_totals(cls, start, end):
+        """
+        Number of orders delivered in [start, end) and their total turnaround time, read from the coarsest
+        buckets covering the range in a single query
+
+        Keyword arguments:
+        start - Start of the range, aligned on a minute
+        end - End of the range, aligned on a minute
+        """
+        totals = cls.get_covering_rollups(start, end).aggregate(
+            throughput=Sum('throughput'), total_turnaround_time=Sum('total_turnaround_time'))
+        return totals['throughput'] or 0, totals['total_turnaround_time'] or timedelta(0)
+
+    def __str__(self):
+        return "{0} {1}".format(self.get_granularity_display(), self.bucket_start)
+
+
+class DishDemandCount(models.Model):
+    """
+    Quantity of a dish ordered for a time-of-day slot of a day, by the time the orders are needed,
+    so scheduled orders are counted in the slot they are scheduled for
+    """
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE, db_index=False)
+    day = models.DateField()
+    slot = models.SmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ["day", "slot", "dish"]
+
+    @staticmethod
+    def get_slot(value):
+        """
+        Day and time-of-day slot of a time, in the current time zone
+
+        """
+        value = timezone.localtime(value)
+        return value.date(), (value.hour * 60 + value.minute) // DishDemand.SLOT_MINUTES
+
+    @classmethod
+    def get_counts(cls, order_dishes):
+        counts = {}
+        for dish_id, needed_at, quantity in order_dishes:
+            key = cls.get_slot(needed_at) + (dish_id, )
+            counts[key] = counts.get(key, 0) + quantity
+        return counts
+
+    @classmethod
+    def record(cls, order_dishes):
+        """
+        Add the dishes of placed orders to the counts of their slot once the transaction placing them commits.
+        The counts of the busiest slots are updated by most orders, so they are not locked for the whole of it.
+
+        Keyword arguments:
+        order_dishes - iterable of (dish id, time the order is needed at, quantity)
+        """
+        transaction.on_commit(partial(cls.add_counts, cls.get_counts(order_dishes)))
+
+    @classmethod
+    def add_counts(cls, counts):
+        """
+        Add to the counts, each one updated in its own short transaction
+
+        Keyword arguments:
+        counts - dict of (day, slot, dish id) -> quantity
+        """
+        for (day, slot, dish_id), quantity in sorted(counts.items()):
+            slot_counts = cls.objects.filter(day=day, slot=slot, dish_id=dish_id)
+            if slot_counts.update(quantity=F('quantity') + quantity):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(day=day, slot=slot, dish_id=dish_id, quantity=quantity)
+            except IntegrityError:
+                # created meanwhile by another order
+                slot_counts.update(quantity=F('quantity') + quantity)
+
+    @classmethod
+    def release(cls, order_dishes):
+        """
+        Take the dishes of orders that will not be prepared, cancelled or rejected ones, out of the counts once
+        the transaction closing them commits
+
+        Keyword arguments:
+        order_dishes - iterable of (dish id, time the order is needed at, quantity)
+        """
+        transaction.on_commit(partial(cls.subtract_counts, cls.get_counts(order_dishes)))
+
+    @classmethod
+    def subtract_counts(cls, counts):
+        """
+        Subtract from the counts, each one updated in its own short transaction
+
+        Keyword arguments:
+        counts - dict of (day, slot, dish id) -> quantity
+        """
+        for (day, slot, dish_id), quantity in sorted(counts.items()):
+            # orders placed before the counts existed were never counted
+            cls.objects.filter(day=day, slot=slot, dish_id=dish_id).update(
+                quantity=Greatest(F('quantity') - quantity, 0))
+
+
+class DishDemand(models.Model):
+    """
+    Exponentially weighted average of the quantity of a dish ordered in a time-of-day slot,
+    folded in once a day from DishDemandCount by squad_pantry_app.forecasting.fold_demand
+    """
+    SLOT_MINUTES = 30
+    SLOTS = 24 * 60 // SLOT_MINUTES
+    # weight of the latest day in the average
+    SMOOTHING = 0.2
+
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE, db_index=False)
+    slot = models.SmallIntegerField()
+    estimate = models.FloatField()
+
+    class Meta:
+        unique_together = ["dish", "slot"]
+
+
+class DemandForecast(models.Model):
+    """
+    Single row holding the last day folded into DishDemand
+    """
+    SINGLETON_ID = 1
+
+    folded_through = models.DateField(blank=True, null=True)
+
+    @classmethod
+    def get(cls):
+        return cls.objects.get_or_create(pk=cls.SINGLETON_ID)[0]
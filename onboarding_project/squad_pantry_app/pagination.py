@@ -0,0 +1,84 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import remove_query_param
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a user's order history, newest first.
+    Cursors hold the (created_at, id) of the last order of a page and the next one is read with a keyset condition
+    on them, so deep pages cost the same as the first one and orders created at the same time are never skipped
+    or repeated. No total count is computed.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        if self.cursor is not None:
+            queryset = self.filter_after(queryset, self.decode_position(self.cursor.position), reverse)
+        if reverse:
+            queryset = queryset.order_by('created_at', 'id')
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # one more order tells whether there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def filter_after(self, queryset, position, reverse):
+        """
+        Orders after position in the order of the pages, or before it when going back
+
+        Keyword arguments:
+        queryset - orders being paginated
+        position - (created_at, id) of the order the cursor points at
+        reverse - True to get the orders before position
+        """
+        created_at, order_id = position
+        if reverse:
+            return queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=order_id))
+        return queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id))
+
+    def decode_position(self, position):
+        try:
+            created_at, order_id = position.split('|')
+            created_at = parse_datetime(created_at)
+            order_id = int(order_id)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, order_id
+
+    def encode_position(self, order):
+        return '{0}|{1}'.format(order.created_at.isoformat(), order.id)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # went back past the newest order
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0])))
@@ -9,3 +9,12 @@ class IsUserWhoPlacedOrder(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # Write permissions are only allowed to the owner of the snippet.
         return obj.placed_by == request.user
+
+
+class IsKitchenStaff(permissions.BasePermission):
+    """
+       Allow only kitchen staff.
+    """
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.is_kitchen_staff)
@@ -0,0 +1,264 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db import OperationalError
+
+logger = logging.getLogger(__name__)
+
+WEB = 'web'
+WORKER = 'worker'
+BEAT = 'beat'
+
+_process_type = os.environ.get('SQUAD_PANTRY_PROCESS', WEB)
+_pools = {}
+_pools_lock = threading.Lock()
+# connections inherited from the parent process, kept referenced so that they are never closed from the child
+_inherited = []
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+def set_process_type(process_type):
+    """
+    Pick the settings.DATABASE_POOL options of this process, before it opens its first connection
+
+    Keyword arguments:
+    process_type - WEB, WORKER or BEAT
+    """
+    global _process_type
+    _process_type = process_type
+
+
+def get_process_type():
+    return _process_type
+
+
+class ConnectionPool(object):
+    """
+    Pool of at most max_size connections to one database, shared by the threads of a process.
+    Checking out waits up to timeout seconds for a connection when they are all in use, then raises PoolTimeout.
+    Connections older than max_age seconds are closed instead of being reused, and the ones idle for
+    health_check_after seconds or more are checked before being handed out.
+    """
+    STATS = ('checkouts', 'waits', 'timeouts', 'connects', 'discarded')
+
+    def __init__(self, connect, max_size, timeout, max_age, health_check_after, check=None, reset=None):
+        """
+        Keyword arguments:
+        connect - callable opening a new connection
+        max_size - maximum number of connections, idle or in use
+        timeout - seconds to wait for a connection, None waits forever
+        max_age - seconds after which a connection is closed, None keeps it open forever
+        health_check_after - idle seconds after which a connection is checked before use, None never checks
+        check - callable raising if the connection it is given can not be used, a SELECT 1 or similar
+        reset - callable rolling back what a returned connection left open, raising if it can not be reused
+        """
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self.check = check
+        self.reset = reset
+        self.condition = threading.Condition()
+        # (connection, opened at, returned at), the most recently returned last
+        self.idle = deque()
+        # opened at of every connection in the pool, by id of the connection
+        self.opened_at = {}
+        self.size = 0
+        self.stats = dict.fromkeys(self.STATS, 0)
+        self.wait_time = 0.0
+
+    def is_expired(self, opened_at, now):
+        return self.max_age is not None and now - opened_at >= self.max_age
+
+    def checkout(self):
+        """
+        Hand out an idle connection, or open one if the pool is not full, waiting for one to be returned otherwise
+
+        """
+        with self.condition:
+            self.stats['checkouts'] += 1
+            if not self.idle and self.size >= self.max_size:
+                self.stats['waits'] += 1
+                start = time.monotonic()
+                try:
+                    if not self.condition.wait_for(lambda: self.idle or self.size < self.max_size, self.timeout):
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeout('No database connection was returned to the pool within {0} seconds, '
+                                          'all {1} are in use'.format(self.timeout, self.max_size))
+                finally:
+                    self.wait_time += time.monotonic() - start
+            if self.idle:
+                # the most recently used connection is the most likely to still be alive
+                connection, opened_at, returned_at = self.idle.pop()
+            else:
+                connection, opened_at, returned_at = None, None, None
+                self.size += 1
+
+        try:
+            if connection is not None and not self.is_usable(connection, opened_at, returned_at):
+                self.close(connection)
+                connection = None
+            if connection is None:
+                connection = self.connect()
+                with self.condition:
+                    self.stats['connects'] += 1
+                    self.opened_at[id(connection)] = time.monotonic()
+        except Exception:
+            self.release_slot()
+            raise
+        return connection
+
+    def is_usable(self, connection, opened_at, returned_at):
+        now = time.monotonic()
+        if self.is_expired(opened_at, now):
+            return False
+        if self.check is None or self.health_check_after is None or now - returned_at < self.health_check_after:
+            return True
+        try:
+            self.check(connection)
+        except Exception:
+            logger.warning('Discarding a pooled database connection that failed its health check', exc_info=True)
+            return False
+        return True
+
+    def checkin(self, connection):
+        """
+        Take a connection back, closing it if it is too old or could not be reset
+
+        """
+        with self.condition:
+            opened_at = self.opened_at.get(id(connection))
+        if opened_at is None:
+            # opened before the process forked, see forget_pools
+            _inherited.append(connection)
+            return
+
+        usable = not self.is_expired(opened_at, time.monotonic())
+        if usable and self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception:
+                logger.warning('Discarding a pooled database connection that could not be reset', exc_info=True)
+                usable = False
+        if not usable:
+            self.close(connection)
+            self.release_slot()
+            return
+
+        with self.condition:
+            self.idle.append((connection, opened_at, time.monotonic()))
+            self.condition.notify()
+
+    def close(self, connection):
+        with self.condition:
+            self.opened_at.pop(id(connection), None)
+            self.stats['discarded'] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def release_slot(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close_idle(self):
+        """
+        Close the idle connections, the ones in use still come back to the pool when returned
+
+        """
+        with self.condition:
+            idle = list(self.idle)
+            self.idle.clear()
+        for connection, opened_at, returned_at in idle:
+            self.close(connection)
+            self.release_slot()
+
+    def metrics(self):
+        with self.condition:
+            metrics = dict(self.stats)
+            metrics.update({
+                'max_size': self.max_size,
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'wait_time_ms': round(self.wait_time * 1000, 3),
+            })
+        return metrics
+
+
+def get_pool_options():
+    """
+    settings.DATABASE_POOL options of the process type of this process
+
+    """
+    options = settings.DATABASE_POOL[_process_type]
+    return {
+        'max_size': options['MAX_SIZE'],
+        'timeout': options.get('TIMEOUT'),
+        'max_age': options.get('MAX_AGE'),
+        'health_check_after': options.get('HEALTH_CHECK_AFTER'),
+    }
+
+
+def get_pool(alias, database, connect, check=None, reset=None):
+    """
+    Pool of the connections to a database, created with the options of this process type on first use.
+    Pools are kept per alias and database, so switching to the test database never hands out a connection to
+    the real one.
+
+    Keyword arguments:
+    alias - alias of the database in settings.DATABASES
+    database - name of the database connected to
+    connect, check, reset - see ConnectionPool
+    """
+    key = (alias, database)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(connect, check=check, reset=reset, **get_pool_options())
+    return pool
+
+
+def close_pools(alias=None):
+    """
+    Close the idle connections of the pools of alias, or of every pool
+
+    """
+    for (pool_alias, database), pool in list(_pools.items()):
+        if alias is None or pool_alias == alias:
+            pool.close_idle()
+
+
+def get_pool_metrics():
+    """
+    Metrics of every pool of this process, as a list of dicts
+
+    """
+    metrics = []
+    for (alias, database), pool in sorted(_pools.items()):
+        pool_metrics = pool.metrics()
+        pool_metrics.update({'alias': alias, 'database': database})
+        metrics.append(pool_metrics)
+    return metrics
+
+
+def forget_pools():
+    # connections are sockets shared with the parent process, closing them from here would close them for it too
+    for pool in _pools.values():
+        _inherited.extend(connection for connection, opened_at, returned_at in pool.idle)
+    _pools.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_pools)
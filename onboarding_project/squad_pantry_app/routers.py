@@ -0,0 +1,108 @@
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_local = threading.local()
+
+
+def get_replica():
+    """
+    Alias of the read replica, None when settings.REPLICA_DATABASE is not set
+
+    """
+    replica = getattr(settings, 'REPLICA_DATABASE', None)
+    if replica == DEFAULT_DB_ALIAS:
+        return None
+    return replica
+
+
+def is_pinned():
+    return getattr(_local, 'pinned', False)
+
+
+def pin_to_primary():
+    """
+    Send every read of this thread to the primary until unpin() is called, so it sees its own writes
+
+    """
+    _local.pinned = True
+
+
+def unpin():
+    _local.pinned = False
+    _local.wrote = False
+
+
+def has_written():
+    """
+    Whether the thread wrote to the primary since it was last unpinned
+
+    """
+    return getattr(_local, 'wrote', False)
+
+
+def get_read_database():
+    """
+    Database reads that tolerate replication lag should go to: the replica, unless there is none,
+    the thread is pinned to the primary or it is inside use_primary
+
+    """
+    replica = get_replica()
+    if replica is None or is_pinned() or getattr(_local, 'primary', 0):
+        return DEFAULT_DB_ALIAS
+    return replica
+
+
+@contextmanager
+def use_replica():
+    """
+    Send the reads made inside the block to the replica. Usable as a decorator
+    """
+    _local.replica = getattr(_local, 'replica', 0) + 1
+    try:
+        yield
+    finally:
+        _local.replica -= 1
+
+
+@contextmanager
+def use_primary():
+    """
+    Keep the reads made inside the block on the primary, even inside use_replica. Usable as a decorator
+    """
+    _local.primary = getattr(_local, 'primary', 0) + 1
+    try:
+        yield
+    finally:
+        _local.primary -= 1
+
+
+class ReplicaRouter(object):
+    """
+    Route reads made inside use_replica to settings.REPLICA_DATABASE and everything else to the primary.
+    A write pins the thread to the primary, squad_pantry_app.middleware.ReplicaPinningMiddleware unpins it
+    when the request ends and onboarding_project.celery when the task ends. A management command stays pinned
+    until it exits.
+    """
+
+    def db_for_read(self, model, **hints):
+        if get_replica() is None:
+            return None
+        if getattr(_local, 'replica', 0):
+            return get_read_database()
+        # explicitly, as an object read from the replica would otherwise bring its related objects from there
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if get_replica() is None:
+            return None
+        pin_to_primary()
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, get_replica()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,60 @@
+import logging
+from datetime import timedelta
+from celery.schedules import schedule
+from django.db import DatabaseError, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigurationSettingsSchedule(schedule):
+    """
+    Celery beat schedule running a task every N seconds, N being a ConfigurationSettings constant.
+    The constant is only read once beat checks the schedule, never when the Celery app is imported,
+    and goes through the ConfigurationSettings cache so a changed value applies without restarting beat.
+    Beat sleeps for at most beat_max_loop_interval seconds, which bounds how long a change takes to apply.
+    The default interval is used while the constant is missing or the database can not be reached.
+    """
+
+    def __init__(self, constant, default, nowfun=None, app=None):
+        self.constant = constant
+        self.default = default
+        self.using_default = False
+        super(ConfigurationSettingsSchedule, self).__init__(nowfun=nowfun, app=app)
+
+    @property
+    def run_every(self):
+        return timedelta(seconds=self.get_interval())
+
+    @run_every.setter
+    def run_every(self, value):
+        # set by schedule.__init__, the interval always comes from the configuration
+        pass
+
+    def get_interval(self):
+        # imported here so that importing the Celery app does not need the Django apps to be loaded
+        from squad_pantry_app.models import ConfigurationSettings
+        try:
+            interval = ConfigurationSettings.get_int(self.constant)
+        except (ConfigurationSettings.DoesNotExist, ValueError, DatabaseError) as error:
+            if not self.using_default:
+                logger.warning('Could not read %s (%s), running every %s seconds', self.constant, error, self.default)
+                self.using_default = True
+            # drop the connection if it broke, the next read reconnects
+            close_old_connections()
+            return self.default
+        self.using_default = False
+        return interval
+
+    def __repr__(self):
+        return '<freq: {0} seconds, {1} by default>'.format(self.constant, self.default)
+
+    def __eq__(self, other):
+        if isinstance(other, ConfigurationSettingsSchedule):
+            return (self.constant, self.default) == (other.constant, other.default)
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __reduce__(self):
+        return self.__class__, (self.constant, self.default, self.nowfun)
@@ -2,8 +2,36 @@ import logging
 from django.utils import timezone
 from rest_framework import serializers
 from django.db import transaction, DatabaseError
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework.exceptions import ValidationError
-from squad_pantry_app.models import Order, OrderDishRelation
+from squad_pantry_app.models import Order, OrderDishRelation, OrderRequest
+from squad_pantry_app.instrumentation import serializer_timer
+
+
+class TimedListSerializer(serializers.ListSerializer):
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super(TimedListSerializer, self).data
+
+
+class OrderListSerializer(TimedListSerializer):
+
+    def to_representation(self, data):
+        orders = Order.add_missing_totals(list(data.all() if hasattr(data, 'all') else data))
+        return super(OrderListSerializer, self).to_representation(orders)
+
+
+class TimedSerializerMixin(object):
+    """
+    Count the time spent building .data as serializer time of the request, see PerformanceMiddleware
+    """
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super(TimedSerializerMixin, self).data
 
 
 class OrderDishRelationSerializer(serializers.ModelSerializer):
@@ -15,14 +43,31 @@ class OrderDishRelationSerializer(serializers.ModelSerializer):
         exclude = ('id', 'order', )
 
 
-class OrderSerializer(serializers.ModelSerializer):
-    dishes = OrderDishRelationSerializer(source='orderdishrelation_set', many=True)
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # dishes are read back from the dish summary of the order
+    dishes = OrderDishRelationSerializer(source='orderdishrelation_set', many=True, write_only=True)
     placed_by = serializers.ReadOnlyField(source='placed_by.username')
 
     class Meta:
         model = Order
-        exclude = ('dish', )
+        exclude = ('dish', 'booked_slot', 'booked_load', 'total_items', 'total_prep_minutes', 'dish_summary')
         read_only_fields = ('status', 'scheduled_time', 'closed_at')
+        list_serializer_class = OrderListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Fetch everything the serializer reads with a constant number of queries, whatever the page size.
+        The dishes come from the dish summary, so that is a single query, and one more for the dishes of the
+        orders not backfilled yet, see OrderListSerializer.
+
+        """
+        return queryset.select_related('placed_by')
+
+    def to_representation(self, instance):
+        data = super(OrderSerializer, self).to_representation(instance)
+        data['dishes'] = instance.get_dishes()
+        return data
 
     def validate(self, attrs):
         if len(attrs['orderdishrelation_set']) < 1:
@@ -31,8 +76,15 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         scheduled_time = self.initial_data.get('scheduled_time')
+        if scheduled_time:
+            scheduled_time = serializers.DateTimeField().to_internal_value(scheduled_time)
+        else:
+            scheduled_time = None
         logged_in_user = self._context['request']._user
-        order = Order.place_order(scheduled_time, logged_in_user, validated_data['orderdishrelation_set'])
+        try:
+            order = Order.place_order(scheduled_time, logged_in_user, validated_data['orderdishrelation_set'])
+        except DjangoValidationError as error:
+            raise ValidationError(error.messages)
         return order
 
     def update(self, instance, validated_data):
@@ -40,3 +92,53 @@ class OrderSerializer(serializers.ModelSerializer):
         instance.closed_at = timezone.now()
         instance.save()
         return instance
+
+
+class BulkOrderDishSerializer(serializers.Serializer):
+    dish = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BulkOrderSerializer(serializers.Serializer):
+    """
+    One order of a batch. Dishes are plain ids, Order.place_orders validates all of them with a single query
+    """
+    scheduled_time = serializers.DateTimeField(required=False, allow_null=True)
+    dishes = BulkOrderDishSerializer(many=True)
+
+
+class OrderHistoryDishSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    quantity = serializers.IntegerField()
+    dish = serializers.IntegerField()
+
+
+class OrderHistorySerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    Live or archived order, read from the dicts of ArchivedOrder.get_order_history in the shape of OrderSerializer
+    """
+    id = serializers.IntegerField()
+    dishes = OrderHistoryDishSerializer(many=True)
+    placed_by = serializers.CharField()
+    status = serializers.IntegerField()
+    scheduled_time = serializers.DateTimeField()
+    created_at = serializers.DateTimeField()
+    closed_at = serializers.DateTimeField()
+    accepted_at = serializers.DateTimeField()
+    start_by = serializers.DateTimeField()
+    archived = serializers.BooleanField()
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+
+class OrderRequestSerializer(serializers.ModelSerializer):
+    """
+    Order placed asynchronously, see OrderViewSet.create
+    """
+    status_display = serializers.ReadOnlyField(source='get_status_display')
+    errors = serializers.ReadOnlyField(source='get_errors')
+
+    class Meta:
+        model = OrderRequest
+        fields = ('handle', 'status', 'status_display', 'order', 'errors', 'created_at', 'processed_at')
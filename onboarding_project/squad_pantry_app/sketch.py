@@ -0,0 +1,76 @@
+import json
+import math
+
+
+class QuantileSketch(object):
+    """
+    Quantile sketch in the style of DDSketch.
+    Values are counted in buckets whose bounds grow geometrically, so every quantile is estimated within
+    RELATIVE_ACCURACY of the true value while the sketch only needs a few hundred buckets to span
+    milliseconds to days. Sketches merge exactly by adding up their bucket counts.
+    """
+    RELATIVE_ACCURACY = 0.01
+    # values below this are counted as zero
+    MIN_VALUE = 1e-3
+
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self, bins=None, zero_count=0):
+        self.bins = bins or {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value, count=1):
+        """
+        Count a value, e.g. a duration in seconds
+
+        Keyword arguments:
+        value - non negative value to add
+        count - number of times the value was seen
+        """
+        if value < self.MIN_VALUE:
+            self.zero_count += count
+        else:
+            key = int(math.ceil(math.log(value) / self.log_gamma))
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def merge(self, other):
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+
+    def quantile(self, q):
+        """
+        Estimate the q-quantile of the added values, None if the sketch is empty
+
+        Keyword arguments:
+        q - quantile between 0 and 1, e.g. 0.99
+        """
+        count = self.count
+        if count == 0:
+            return None
+
+        rank = q * (count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # midpoint of the bucket (gamma^(key-1), gamma^key] relative to its bounds
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_json(self):
+        return json.dumps({'bins': self.bins, 'zero_count': self.zero_count}, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, data):
+        if not data:
+            return cls()
+        data = json.loads(data)
+        return cls({int(key): count for key, count in data['bins'].items()}, data['zero_count'])
@@ -1,10 +1,49 @@
-from datetime import timedelta
-from django.test import TestCase
+import json
+import pickle
+import sqlite3
+from io import StringIO
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
-from squad_pantry_app.models import Order, SquadUser, ConfigurationSettings, PerformanceMetrics
+from celery.signals import task_postrun
+from rest_framework.test import APIClient
+from onboarding_project.tasks import place_pending_orders
+from squad_pantry_app.events import KombuBroker, get_broker, order_channel
+from squad_pantry_app.instrumentation import get_request_histograms
+from squad_pantry_app.middleware import ReplicaPinningMiddleware
+from squad_pantry_app.sketch import QuantileSketch
+from squad_pantry_app.models import Order, SquadUser, ConfigurationSettings, PerformanceMetrics, Dish, \
+    OpenOrderCounter, OrderDishRelation, MetricsRollup, OrderStatusEvent, ArchivedOrder, OrderRequest, \
+    DishDemand, DishDemandCount, KitchenSlot
+from squad_pantry_app.analytics import get_stage_durations
+from squad_pantry_app.benchmarks import seed, run_benchmarks
+from squad_pantry_app.schedules import ConfigurationSettingsSchedule
+from squad_pantry_app.locks import try_lock
+from squad_pantry_app.pool import ConnectionPool, PoolTimeout
+from squad_pantry_app.routers import is_pinned, unpin, use_primary, use_replica
+from squad_pantry_app.forecasting import fold_demand, get_prep_ahead
 
 
-class OrderTestCase(TestCase):
+class ConfigurationSettingsCacheMixin(object):
+    """
+    Drop the settings cached by a test, the rollback at the end of the test does not invalidate them
+    """
+
+    def tearDown(self):
+        super(ConfigurationSettingsCacheMixin, self).tearDown()
+        ConfigurationSettings.invalidate()
+
+
+class OrderTestCase(ConfigurationSettingsCacheMixin, TestCase):
     def setUp(self):
         self.user1 = SquadUser.objects.create(username="prakhar", password="testdb1",
                                               is_superuser=True, is_kitchen_staff=False)
@@ -33,8 +72,53 @@ class OrderTestCase(TestCase):
 
         self.assertEquals(Order.check_limit(), True)
 
+    def test_configuration_settings_cache(self):
+        setting = ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=2)
+        self.assertEquals(ConfigurationSettings.get_int('ORDER_LIMIT'), 2)
+        with self.assertNumQueries(0):
+            self.assertEquals(ConfigurationSettings.get_int('ORDER_LIMIT'), 2)
+
+        setting.value = 5
+        setting.save()
+        self.assertEquals(ConfigurationSettings.get_int('ORDER_LIMIT'), 5)
+
+        with self.assertNumQueries(1):
+            for _ in range(2):
+                with self.assertRaises(ConfigurationSettings.DoesNotExist):
+                    ConfigurationSettings.get_int('SLOT_CAPACITY')
+        ConfigurationSettings.objects.create(constant='SLOT_CAPACITY', value=60)
+        self.assertEquals(ConfigurationSettings.get_int('SLOT_CAPACITY'), 60)
+
+    def test_open_order_counter(self):
+        order = Order.objects.create(placed_by=self.user1, status=Order.ORDER_PLACED)
+        Order.objects.create(placed_by=self.user1, status=Order.DELIVERED)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 1)
+
+        order.status = Order.PROCESSING
+        order.save()
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 1)
+
+        order = Order.objects.get(id=order.id)
+        order.status = Order.DELIVERED
+        order.save()
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 0)
+
+    def test_place_order_rejected_over_limit(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=1)
+        dish = Dish.objects.create(dish_name='Dosa', dish_type=Dish.VEG, is_available=True, prep_time_in_minutes=5)
+        dishes = [{'dish': dish, 'quantity': 1}]
+
+        order = Order.place_order(None, self.user1, dishes)
+        self.assertEquals(order.orderdishrelation_set.count(), 1)
+        with self.assertRaises(ValidationError):
+            Order.place_order(None, self.user2, dishes)
+        self.assertEquals(Order.objects.count(), 1)
+
+        self.assertEquals(order.cancel_order(self.user1.id), Order.CANCEL_SUCCESS)
+        self.assertIsNotNone(Order.place_order(None, self.user2, dishes))
+
     def test_calculate_avg_metrics(self):
-        current = timezone.now()
+        current = timezone.now() - timedelta(hours=2)
         later = current + timedelta(hours=1)
         order1 = Order.objects.create(placed_by=self.user1, status=Order.DELIVERED)
         order2 = Order.objects.create(placed_by=self.user1, status=Order.DELIVERED)
@@ -44,3 +128,715 @@ class OrderTestCase(TestCase):
 
         PerformanceMetrics.objects.create(average_throughput=2, average_turnaround_time=timedelta(seconds=0))
         self.assertEquals(PerformanceMetrics.calculate_avg_performance_metrics(), (timedelta(seconds=0), 0))
+
+    def test_create_avg_metrics_advances_watermark(self):
+        current = timezone.now() - timedelta(hours=2)
+        order = Order.objects.create(placed_by=self.user1, status=Order.DELIVERED)
+        Order.objects.filter(id=order.id).update(created_at=current, closed_at=current + timedelta(minutes=30))
+        late = Order.objects.create(placed_by=self.user1, status=Order.DELIVERED)
+        closed_at = timezone.now()
+        Order.objects.filter(id=late.id).update(created_at=closed_at - timedelta(hours=1), closed_at=closed_at)
+
+        # the window trails the current time, an order closed just now is left to the next one
+        PerformanceMetrics.create_avg_performance_metrics()
+        metrics = PerformanceMetrics.objects.get()
+        self.assertEquals(metrics.average_throughput, 1)
+        self.assertEquals(metrics.average_turnaround_time, timedelta(minutes=30))
+        self.assertEquals(PerformanceMetrics.get_watermark(), metrics.window_end)
+        self.assertEquals(PerformanceMetrics.calculate_avg_performance_metrics(), (timedelta(hours=1), 1))
+
+    def test_create_avg_metrics_is_idempotent(self):
+        first = PerformanceMetrics.create_avg_performance_metrics()
+        self.assertIsNone(first.window_start)
+        self.assertIsNone(PerformanceMetrics.create_avg_performance_metrics(min_window=timedelta(minutes=1)))
+
+        with try_lock(PerformanceMetrics.LOCK_NAME) as acquired:
+            self.assertTrue(acquired)
+            self.assertIsNone(PerformanceMetrics.create_avg_performance_metrics())
+
+        second = PerformanceMetrics.create_avg_performance_metrics()
+        self.assertEquals(second.window_start, first.window_end)
+        self.assertEquals(PerformanceMetrics.objects.count(), 2)
+
+    def test_metrics_rollups(self):
+        for closed_at, turnaround_minutes in [(datetime(2018, 2, 9, 23, 59, tzinfo=timezone.utc), 10),
+                                              (datetime(2018, 2, 10, 12, 30, tzinfo=timezone.utc), 20),
+                                              (datetime(2018, 2, 11, 0, 1, tzinfo=timezone.utc), 60)]:
+            order = Order.objects.create(placed_by=self.user1, status=Order.DELIVERED)
+            Order.objects.filter(id=order.id).update(created_at=closed_at - timedelta(minutes=turnaround_minutes),
+                                                     closed_at=closed_at)
+        PerformanceMetrics.create_avg_performance_metrics()
+
+        self.assertEquals(MetricsRollup.objects.filter(granularity=MetricsRollup.DAY).count(), 3)
+        self.assertEquals(PerformanceMetrics.get_metrics_data('2018-02-10', '2018-02-10'), (1, '0:20:00'))
+        self.assertEquals(PerformanceMetrics.get_metrics_data('2018-02-09', '2018-02-10'), (2, '0:15:00'))
+        self.client.force_login(self.user1)
+        response = self.client.get(reverse('squad_pantry_app:metrics'),
+                                   {'start_date': '2018-02-10', 'end_date': '2018-02-10'})
+        self.assertEquals(response.context['throughput'], 1)
+
+        start = datetime(2018, 2, 9, 23, 59, tzinfo=timezone.utc)
+        end = datetime(2018, 2, 11, 0, 2, tzinfo=timezone.utc)
+        self.assertEquals(MetricsRollup.get_covering_buckets(start, end), [
+            (MetricsRollup.MINUTE, start, datetime(2018, 2, 10, tzinfo=timezone.utc)),
+            (MetricsRollup.DAY, datetime(2018, 2, 10, tzinfo=timezone.utc), datetime(2018, 2, 11, tzinfo=timezone.utc)),
+            (MetricsRollup.MINUTE, datetime(2018, 2, 11, tzinfo=timezone.utc), end),
+        ])
+        self.assertEquals(MetricsRollup.get_totals(start, end), (3, timedelta(minutes=90)))
+
+        turnaround, queue_wait, delivery = PerformanceMetrics.get_percentiles('2018-02-09', '2018-02-11')
+        self.assertEquals(turnaround, ('Turnaround (placed to delivered)', ['0:20:00', '0:20:00', '0:20:00']))
+        turnaround = PerformanceMetrics.get_percentiles('2018-02-11', '2018-02-11')[0]
+        # estimated within the 1% accuracy of the sketch
+        self.assertEquals(turnaround[1], ['1:00:06', '1:00:06', '1:00:06'])
+        # none of the orders went through ACCEPTED
+        self.assertEquals(queue_wait[1], ['-', '-', '-'])
+
+    def test_metrics_rollups_long_window(self):
+        start = datetime(2018, 2, 9, tzinfo=timezone.utc)
+        Order.objects.bulk_create([Order(placed_by=self.user1, status=Order.DELIVERED) for _ in range(1500)])
+        for minute, order_id in enumerate(Order.objects.order_by('id').values_list('id', flat=True)):
+            closed_at = start + timedelta(minutes=minute)
+            Order.objects.filter(id=order_id).update(created_at=closed_at - timedelta(minutes=10), closed_at=closed_at)
+        MetricsRollup.record_window(None, start + timedelta(days=2))
+
+        self.assertEquals(MetricsRollup.objects.filter(granularity=MetricsRollup.MINUTE).count(), 1500)
+        self.assertEquals(MetricsRollup.objects.filter(granularity=MetricsRollup.HOUR).count(), 25)
+        self.assertEquals(MetricsRollup.get_totals(start, start + timedelta(minutes=1500)),
+                          (1500, timedelta(minutes=15000)))
+
+    def test_status_event_log(self):
+        order = Order.objects.create(placed_by=self.user1)
+        for status in [Order.ACCEPTED, Order.DELIVERED]:
+            order.status = status
+            order.save()
+        order.save()
+        events = OrderStatusEvent.objects.filter(order=order).order_by('created_at')
+        self.assertEquals([event.status for event in events], [Order.ORDER_PLACED, Order.ACCEPTED, Order.DELIVERED])
+
+        start = timezone.now() - timedelta(hours=1)
+        for minutes, event in zip([0, 5, 25], events):
+            OrderStatusEvent.objects.filter(id=event.id).update(created_at=start + timedelta(minutes=minutes))
+        durations = get_stage_durations(start, timezone.now())
+        self.assertEquals(durations['throughput'][Order.DELIVERED], 1)
+        self.assertEquals(durations['stages'][(Order.ORDER_PLACED, Order.ACCEPTED)]['average'], timedelta(minutes=5))
+        self.assertEquals(durations['stages'][(Order.ACCEPTED, Order.DELIVERED)]['average'], timedelta(minutes=20))
+
+    def test_export_data(self):
+        order = Order.objects.create(placed_by=self.user1)
+        Order.objects.create(placed_by=self.user2, status=Order.DELIVERED)
+
+        output = StringIO()
+        call_command('export_data', 'orders', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEquals(lines[0].split(',')[:3], ['id', 'placed_by__username', 'status'])
+        self.assertEquals(lines[1].split(',')[:3], [str(order.id), 'prakhar', str(Order.ORDER_PLACED)])
+        self.assertEquals(len(lines), 3)
+
+        output = StringIO()
+        call_command('export_data', 'orders', format='ndjson', chunk_size=1, stdout=output)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEquals([row['placed_by__username'] for row in rows], ['prakhar', 'prakhar2'])
+
+    def test_quantile_sketch(self):
+        values = list(range(1, 1001))
+        first_half, second_half = QuantileSketch(), QuantileSketch()
+        for value in values[:500]:
+            first_half.add(value)
+        for value in values[500:]:
+            second_half.add(value)
+        sketch = QuantileSketch.from_json(first_half.to_json())
+        sketch.merge(second_half)
+
+        self.assertEquals(sketch.count, 1000)
+        for q in [0.5, 0.9, 0.99]:
+            expected = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), expected, delta=expected * QuantileSketch.RELATIVE_ACCURACY)
+
+    def test_benchmarks(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=100)
+        seed(users=5, orders=50, dishes=4, open_orders=10, batch_size=20)
+        self.assertEquals(Order.objects.count(), 50)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 10)
+        self.assertTrue(Order.objects.filter(created_at__lt=timezone.now() - timedelta(hours=1)).exists())
+        self.assertFalse(Order.objects.filter(orderdishrelation=None).exists())
+
+        results = run_benchmarks(SquadUser.objects.get(username='bench0'), repeat=3)
+        self.assertEquals(results['benchmarks']['place_order']['runs'], 3)
+        self.assertGreater(results['benchmarks']['order_list']['queries'], 0)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 10)
+        # nothing is left behind for the next run
+        self.assertEquals(Order.objects.count(), 50)
+        self.assertFalse(OrderStatusEvent.objects.exists())
+
+    def test_configuration_settings_schedule(self):
+        schedule = ConfigurationSettingsSchedule('INTERVAL', default=10)
+        with self.assertLogs('squad_pantry_app.schedules', 'WARNING'):
+            self.assertEquals(schedule.run_every, timedelta(seconds=10))
+
+        setting = ConfigurationSettings.objects.create(constant='INTERVAL', value=30)
+        self.assertEquals(schedule.run_every, timedelta(seconds=30))
+        self.assertFalse(schedule.is_due(timezone.now() - timedelta(seconds=20)).is_due)
+        setting.value = 15
+        setting.save()
+        self.assertTrue(schedule.is_due(timezone.now() - timedelta(seconds=20)).is_due)
+        self.assertEquals(pickle.loads(pickle.dumps(schedule)), schedule)
+
+
+class OrderViewSetTestCase(ConfigurationSettingsCacheMixin, TestCase):
+    def setUp(self):
+        self.user = SquadUser.objects.create(username="prakhar", password="testdb1")
+        self.dishes = [
+            Dish.objects.create(dish_name='Dish {0}'.format(i), dish_type=Dish.VEG, is_available=True,
+                                prep_time_in_minutes=5)
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(placed_by=self.user)
+            OrderDishRelation.objects.bulk_create([
+                OrderDishRelation(order=order, dish=dish, quantity=1) for dish in self.dishes
+            ])
+            # bulk_create skips the post_save signal keeping the totals up to date
+            order.update_totals()
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('squad_pantry_app:order-list'))
+        self.assertEquals(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_is_constant(self):
+        self.create_orders(1)
+        single_order_queries = self.count_list_queries()
+
+        self.create_orders(9)
+        self.assertEquals(self.count_list_queries(), single_order_queries)
+
+    def test_cursor_pagination(self):
+        self.create_orders(3)
+        url = reverse('squad_pantry_app:order-list')
+
+        response = self.client.get(url, {'paginate': 'cursor', 'page_size': 2})
+        self.assertNotIn('count', response.data)
+        self.assertEquals(len(response.data['results']), 2)
+
+        response = self.client.get(response.data['next'])
+        self.assertEquals(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+        # orders created at the same time are told apart by their id
+        Order.objects.update(created_at=timezone.now())
+        order_ids = list(Order.objects.order_by('-id').values_list('id', flat=True))
+        first_page = self.client.get(url, {'paginate': 'cursor', 'page_size': 2}).data
+        second_page = self.client.get(first_page['next']).data
+        self.assertEquals([order['id'] for order in first_page['results'] + second_page['results']], order_ids)
+        previous_page = self.client.get(second_page['previous']).data
+        self.assertEquals(previous_page['results'], first_page['results'])
+
+        response = self.client.get(url, {'paginate': 'cursor', 'include_archived': 'true'})
+        self.assertEquals(response.status_code, 400)
+
+    def test_bulk_order_placement(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=3)
+        unavailable = Dish.objects.create(dish_name='Biryani', dish_type=Dish.NON_VEG, prep_time_in_minutes=20)
+        url = reverse('squad_pantry_app:order-bulk')
+        order = {'dishes': [{'dish': self.dishes[0].id, 'quantity': 2}, {'dish': self.dishes[1].id, 'quantity': 1}]}
+
+        response = self.client.post(url, [order, order, {'dishes': [{'dish': unavailable.id, 'quantity': 1}]}],
+                                    format='json')
+        self.assertEquals(response.status_code, 207)
+        self.assertEquals(len(response.data[0]['order']['dishes']), 2)
+        self.assertIn('errors', response.data[2])
+        self.assertEquals(OrderDishRelation.objects.count(), 4)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 2)
+
+        response = self.client.post(url, [order, order], format='json')
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(Order.objects.count(), 2)
+
+    def test_past_scheduled_time(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=3)
+        yesterday = (timezone.now() - timedelta(days=1)).isoformat()
+        order = {'scheduled_time': yesterday, 'dishes': [{'dish': self.dishes[0].id, 'quantity': 1}]}
+
+        response = self.client.post(reverse('squad_pantry_app:order-list'), order, format='json')
+        self.assertEquals(response.status_code, 400)
+        response = self.client.post(reverse('squad_pantry_app:order-bulk'), [order], format='json')
+        self.assertEquals(response.data[0]['errors'], [Order.PAST_DATE_ERROR])
+        self.assertEquals(Order.objects.count(), 0)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 0)
+
+    def test_async_order_placement(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=1)
+        url = reverse('squad_pantry_app:order-list')
+        order = {'dishes': [{'dish': self.dishes[0].id, 'quantity': 2}]}
+
+        responses = [self.client.post(url + '?mode=async', order, format='json') for _ in range(2)]
+        self.assertEquals([response.status_code for response in responses], [202, 202])
+        self.assertEquals(Order.objects.count(), 0)
+        first = self.client.get(responses[0]['Location'])
+        self.assertEquals(first.data['status'], OrderRequest.PENDING)
+
+        self.assertEquals(OrderRequest.place_pending(10), 2)
+        self.assertEquals(OrderRequest.place_pending(10), 0)
+        first, second = [self.client.get(response['Location']).data for response in responses]
+        self.assertEquals(first['status'], OrderRequest.PLACED)
+        self.assertEquals(Order.objects.get().id, first['order'])
+        self.assertEquals(OrderDishRelation.objects.get().quantity, 2)
+        self.assertEquals(second['status'], OrderRequest.FAILED)
+        self.assertIn('heavy traffic', second['errors'][0])
+
+    def test_kitchen_slot_booking(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=10)
+        ConfigurationSettings.objects.create(constant='SLOT_CAPACITY', value=12)
+        lunch = (timezone.now() + timedelta(days=1)).replace(hour=12, minute=40, second=0, microsecond=0)
+        dishes = [{'dish': self.dishes[0], 'quantity': 1}]
+
+        first = Order.place_order(lunch, self.user, dishes)
+        Order.place_order(lunch, self.user, dishes)
+        with self.assertRaises(ValidationError):
+            Order.place_order(lunch.replace(minute=50), self.user, dishes)
+        results = Order.place_orders(self.user, [{'scheduled_time': lunch,
+                                                  'dishes': [{'dish': self.dishes[0].id, 'quantity': 1}]}])
+        self.assertIn('fully booked', results[0]['errors'][0])
+        self.assertEquals(KitchenSlot.objects.get().load, 10)
+
+        first.cancel_order(self.user.id)
+        self.assertEquals(KitchenSlot.objects.get().load, 5)
+        first = Order.objects.get(pk=first.pk)
+        first.status = Order.ACCEPTED
+        first.save()
+        self.assertEquals(KitchenSlot.objects.get().load, 10)
+
+        first.cancel_order(self.user.id)
+        Order.place_order(lunch, self.user, dishes)
+        first = Order.objects.get(pk=first.pk)
+        first.status = Order.ACCEPTED
+        with self.assertRaises(ValidationError):
+            first.save()
+        self.assertEquals(Order.objects.get(pk=first.pk).status, Order.CANCELLED)
+        self.assertEquals(KitchenSlot.objects.get().load, 10)
+
+        response = self.client.get(reverse('squad_pantry_app:kitchen-slots'), {'date': lunch.date().isoformat()})
+        available = {slot['slot_start']: slot['available_minutes'] for slot in response.data}
+        self.assertEquals(len(available), 48)
+        self.assertEquals(available[lunch.replace(minute=30)], 2)
+        self.assertEquals(available[lunch.replace(minute=0)], 12)
+        response = self.client.get(reverse('squad_pantry_app:kitchen-slots'), {'date': '2026-02-30'})
+        self.assertEquals(response.status_code, 400)
+
+    def test_admin_order_placement(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=1)
+        ConfigurationSettings.objects.create(constant='SLOT_CAPACITY', value=12)
+        lunch = (timezone.now() + timedelta(days=1)).replace(hour=12, minute=40, second=0, microsecond=0)
+        self.client.force_login(SquadUser.objects.create(username="admin", is_staff=True, is_superuser=True))
+        url = reverse('admin:squad_pantry_app_order_add')
+        data = {
+            'status': Order.ORDER_PLACED,
+            'scheduled_time_0': lunch.strftime('%Y-%m-%d'),
+            'scheduled_time_1': lunch.strftime('%H:%M:%S'),
+            'orderdishrelation_set-TOTAL_FORMS': 1,
+            'orderdishrelation_set-INITIAL_FORMS': 0,
+            'orderdishrelation_set-0-dish': self.dishes[0].id,
+            'orderdishrelation_set-0-quantity': 2,
+        }
+
+        self.assertEquals(self.client.post(url, data).status_code, 302)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 1)
+        self.assertEquals(KitchenSlot.objects.get().load, 10)
+        self.assertEquals(Order.objects.get().booked_load, 10)
+
+        # another order took the last admission between the form check and the save
+        data['orderdishrelation_set-0-quantity'] = 1
+        data['scheduled_time_1'] = '13:40:00'
+        with mock.patch.object(Order, 'check_limit', return_value=False):
+            self.assertEquals(self.client.post(url, data).status_code, 302)
+        self.assertEquals(Order.objects.count(), 1)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 1)
+
+        # over SLOT_CAPACITY, the form is shown again
+        ConfigurationSettings.objects.filter(constant='ORDER_LIMIT').update(value=5)
+        ConfigurationSettings.invalidate()
+        data['scheduled_time_1'] = lunch.strftime('%H:%M:%S')
+        self.assertEquals(self.client.post(url, data).status_code, 200)
+        self.assertEquals(Order.objects.count(), 1)
+
+    def test_kitchen_queue(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=10)
+        slow_dish = Dish.objects.create(dish_name='Biryani', dish_type=Dish.NON_VEG, is_available=True,
+                                        prep_time_in_minutes=30)
+        quick = Order.place_order(None, self.user, [{'dish': self.dishes[0], 'quantity': 1}])
+        slow = Order.place_order(None, self.user, [{'dish': slow_dish, 'quantity': 2}])
+        later = Order.place_order(timezone.now() + timedelta(hours=2), self.user, [{'dish': slow_dish, 'quantity': 1}])
+        self.assertAlmostEqual(slow.start_by, slow.created_at - timedelta(minutes=60), delta=timedelta(seconds=1))
+
+        self.assertEquals(list(Order.kitchen_queue()), [slow, quick, later])
+        slow.cancel_order(self.user.id)
+        self.assertEquals(list(Order.kitchen_queue()), [quick, later])
+
+        url = reverse('squad_pantry_app:kitchen-queue')
+        self.assertEquals(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(SquadUser.objects.create(username="kitchen", is_kitchen_staff=True))
+        response = self.client.get(url)
+        self.assertEquals([order['id'] for order in response.data['results']], [quick.id, later.id])
+
+    def test_archived_order_history(self):
+        self.create_orders(3)
+        old, recent, open_order = Order.objects.order_by('id')
+        for order in [old, recent]:
+            order.status = Order.DELIVERED
+            order.save()
+        Order.objects.filter(id=old.id).update(closed_at=timezone.now() - timedelta(days=60))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(ArchivedOrder.archive_batch(timezone.now() - timedelta(days=30), 10), 1)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "squad_pantry_app_order"')])
+        self.assertFalse(OrderDishRelation.objects.filter(order_id=old.id).exists())
+        self.assertEquals(ArchivedOrder.archive_batch(timezone.now() - timedelta(days=30), 10), 0)
+        self.assertEquals(list(Order.objects.values_list('id', flat=True).order_by('id')), [recent.id, open_order.id])
+
+        url = reverse('squad_pantry_app:order-list')
+        self.assertEquals(self.client.get(url).data['count'], 2)
+        response = self.client.get(url, {'include_archived': 'true'})
+        self.assertEquals(response.data['count'], 3)
+        archived = [order for order in response.data['results'] if order['archived']]
+        self.assertEquals([order['id'] for order in archived], [old.id])
+        self.assertEquals(len(archived[0]['dishes']), 3)
+
+        response = self.client.get(reverse('squad_pantry_app:order-detail', kwargs={'pk': old.id}))
+        self.assertEquals(response.data['status'], Order.DELIVERED)
+        self.assertTrue(response.data['archived'])
+
+    def test_request_timings(self):
+        get_request_histograms().reset()
+        self.create_orders(2)
+        self.client.get(reverse('squad_pantry_app:order-list'))
+        self.client.get(reverse('squad_pantry_app:order-list'))
+
+        url = reverse('squad_pantry_app:performance')
+        self.assertEquals(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(SquadUser.objects.create(username="admin", is_staff=True))
+        timings = self.client.get(url).data['squad_pantry_app:order-list']
+        self.assertEquals(timings['requests'], 2)
+        self.assertGreater(timings['queries']['p50'], 0)
+        self.assertGreater(timings['serializer_time_ms']['mean'], 0)
+
+    def test_order_totals(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=10)
+        order = Order.place_order(None, self.user, [{'dish': self.dishes[0], 'quantity': 2},
+                                                    {'dish': self.dishes[1], 'quantity': 1}])
+        self.assertEquals((order.total_items, order.total_prep_minutes), (3, 15))
+        OrderDishRelation.objects.create(order=order, dish=self.dishes[2], quantity=1)
+        order.refresh_from_db()
+        self.assertEquals((order.total_items, order.total_prep_minutes), (4, 20))
+        extra_dish = Dish.objects.create(dish_name='Dish 3', dish_type=Dish.VEG, is_available=True,
+                                         prep_time_in_minutes=5)
+        OrderDishRelation.objects.create(order=order, dish=extra_dish, quantity=1).delete()
+        order.refresh_from_db()
+        self.assertEquals((order.total_items, order.total_prep_minutes), (4, 20))
+
+        self.create_orders(3)
+        backfilled_queries = self.count_list_queries()
+        Order.objects.update(total_items=0, total_prep_minutes=0, dish_summary='')
+        # the dishes of the orders not backfilled yet are read with one more query, not one per order
+        self.assertEquals(self.count_list_queries(), backfilled_queries + 1)
+        dishes = self.client.get(reverse('squad_pantry_app:order-list')).data['results'][-1]['dishes']
+        self.assertEquals([dish['name'] for dish in dishes], ['Dish 0', 'Dish 1', 'Dish 2'])
+        call_command('backfill_order_totals', stdout=StringIO())
+        order.refresh_from_db()
+        self.assertEquals((order.total_items, order.total_prep_minutes), (4, 20))
+        dishes = self.client.get(reverse('squad_pantry_app:order-list')).data['results'][-1]['dishes']
+        self.assertEquals([(dish['name'], dish['quantity']) for dish in dishes],
+                          [('Dish 0', 2), ('Dish 1', 1), ('Dish 2', 1)])
+
+
+class OrderEventsTestCase(ConfigurationSettingsCacheMixin, TransactionTestCase):
+    def setUp(self):
+        self.user = SquadUser.objects.create(username="prakhar", password="testdb1")
+
+    def test_status_change_is_published(self):
+        order = Order.objects.create(placed_by=self.user)
+        subscription = get_broker().subscribe(order_channel(self.user.id))
+        try:
+            order.status = Order.ACCEPTED
+            order.save()
+            order.scheduled_time = timezone.now() + timedelta(hours=1)
+            order.save()
+            self.assertEquals(subscription.get(timeout=1)['status_display'], 'Accepted')
+            self.assertIsNone(subscription.get(timeout=0))
+        finally:
+            subscription.close()
+
+    def test_event_stream(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('squad_pantry_app:order-events'))
+        self.assertEquals(response['Content-Type'], 'text/event-stream')
+        stream = iter(response.streaming_content)
+        next(stream)
+
+        order = Order.objects.create(placed_by=self.user)
+        self.assertIn('"id": {0}'.format(order.id), next(stream).decode())
+        response.close()
+
+    @skipUnless(hasattr(connection, 'pool'), 'connections are pooled by the postgresql_pool backend')
+    def test_event_stream_releases_its_connection(self):
+        client = APIClient()
+        client.force_login(self.user)
+        response = client.get(reverse('squad_pantry_app:order-events'))
+        pool = connection.pool
+        # times out if the open stream still holds a connection
+        connections = [pool.checkout() for _ in range(pool.max_size)]
+        for pooled_connection in connections:
+            pool.checkin(pooled_connection)
+        response.close()
+
+    def test_events_between_processes(self):
+        web, worker = KombuBroker('memory://localhost/'), KombuBroker('memory://localhost/')
+        subscription = web.subscribe(order_channel(self.user.id))
+        try:
+            self.assertTrue(web.consuming.wait(timeout=5))
+            worker.publish(order_channel(self.user.id), {'id': 1})
+            self.assertEquals(subscription.get(timeout=5), {'id': 1})
+        finally:
+            subscription.close()
+
+    def test_unreachable_events_broker(self):
+        with self.assertLogs(level='ERROR'):
+            KombuBroker('pyamqp://guest@localhost:1//').publish(order_channel(self.user.id), {'id': 1})
+
+
+class DishDemandTestCase(ConfigurationSettingsCacheMixin, TransactionTestCase):
+    def setUp(self):
+        self.user = SquadUser.objects.create(username="prakhar", password="testdb1")
+        self.dishes = [
+            Dish.objects.create(dish_name='Dish {0}'.format(i), dish_type=Dish.VEG, is_available=True,
+                                prep_time_in_minutes=5)
+            for i in range(3)
+        ]
+
+    def test_dish_demand_forecast(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=10)
+        lunch = datetime(2018, 2, 9, 12, 40, tzinfo=timezone.utc)
+        for day, quantity in [(0, 4), (1, 2)]:
+            DishDemandCount.record([(self.dishes[0].id, lunch + timedelta(days=day), quantity)])
+        self.assertEquals(fold_demand(lunch.date()), 1)
+        self.assertEquals(fold_demand(lunch.date() + timedelta(days=2)), 2)
+        # 4 on the first day, then 2 and a day without orders weighing 0.2 each
+        self.assertAlmostEqual(DishDemand.objects.get(slot=25).estimate, (4 * 0.8 + 2 * 0.2) * 0.8)
+        self.assertEquals(fold_demand(lunch.date() + timedelta(days=2)), 0)
+
+        # a scheduled order counts in the slot it is needed in, on top of the forecast
+        needed_at = timezone.now().replace(hour=12, minute=45) + timedelta(days=1)
+        with transaction.atomic():
+            order = Order.place_order(needed_at, self.user, [{'dish': self.dishes[1], 'quantity': 5}])
+            # counted once the order is committed
+            self.assertFalse(DishDemandCount.objects.filter(dish=self.dishes[1]).exists())
+        slot_start, dishes = get_prep_ahead(needed_at, slots=1)[0]
+        self.assertEquals(slot_start, needed_at.replace(minute=30, second=0, microsecond=0))
+        self.assertEquals(dishes, [
+            {'dish': 'Dish 1', 'forecast': 0.0, 'ordered': 5, 'expected': 5},
+            {'dish': 'Dish 0', 'forecast': 2.9, 'ordered': 0, 'expected': 3},
+        ])
+        # a cancelled order will not be cooked
+        order.cancel_order(self.user.id)
+        self.assertEquals(DishDemandCount.objects.get(dish=self.dishes[1]).quantity, 0)
+
+        kitchen = SquadUser.objects.create(username="kitchen", is_kitchen_staff=True, is_staff=True)
+        self.client.force_login(kitchen)
+        self.assertEquals(self.client.get(reverse('squad_pantry_app:prep-ahead')).status_code, 200)
+
+
+class MenuTestCase(ConfigurationSettingsCacheMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.dish = Dish.objects.create(dish_name='Dosa', dish_type=Dish.VEG, is_available=True,
+                                        prep_time_in_minutes=5)
+        Dish.objects.create(dish_name='Biryani', dish_type=Dish.NON_VEG, prep_time_in_minutes=20)
+        self.client = APIClient()
+
+    def test_menu_revalidation(self):
+        url = reverse('squad_pantry_app:dish-list')
+        response = self.client.get(url)
+        self.assertEquals([dish['dish_name'] for dish in response.data], ['Dosa'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        self.dish.prep_time_in_minutes = 10
+        with transaction.atomic():
+            self.dish.save()
+            # the menu is only invalidated once the change is committed
+            self.assertEquals(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class OrderIndexTestCase(ConfigurationSettingsCacheMixin, TestCase):
+    def setUp(self):
+        self.user = SquadUser.objects.create(username="prakhar", password="testdb1")
+
+    def assertUsesIndex(self, queryset, index_name):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            # a sequential scan is always cheapest on a near empty table, so rule it out
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn(index_name, plan)
+
+    def test_order_history_uses_placed_by_created_at_idx(self):
+        queryset = Order.objects.filter(placed_by=self.user).order_by('-created_at')
+        self.assertUsesIndex(queryset, 'placed_by_created_at_idx')
+
+    def test_open_orders_use_open_orders_idx(self):
+        queryset = Order.objects.filter(status__in=Order.OPEN_ORDERS)
+        self.assertUsesIndex(queryset, 'open_orders_idx')
+
+    def test_delivered_window_uses_status_closed_at_idx(self):
+        now = timezone.now()
+        queryset = Order.objects.filter(status=Order.DELIVERED, closed_at__gt=now - timedelta(minutes=1),
+                                        closed_at__lte=now)
+        self.assertUsesIndex(queryset, 'status_closed_at_idx')
+
+
+@skipUnless(connection.features.can_return_ids_from_bulk_insert, 'orders are bulk created on PostgreSQL')
+class BulkOrderPlacementTestCase(ConfigurationSettingsCacheMixin, TransactionTestCase):
+    def setUp(self):
+        self.user = SquadUser.objects.create(username="prakhar", password="testdb1")
+        self.dish = Dish.objects.create(dish_name='Dosa', dish_type=Dish.VEG, is_available=True,
+                                        prep_time_in_minutes=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_created_orders_are_recorded(self):
+        ConfigurationSettings.objects.create(constant='ORDER_LIMIT', value=5)
+        order = {'dishes': [{'dish': self.dish.id, 'quantity': 2}]}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('squad_pantry_app:order-bulk'), [order, order], format='json')
+        self.assertEquals(response.status_code, 201)
+        # the orders themselves are inserted in one query
+        order_inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "squad_pantry_app_order"')]
+        self.assertEquals(len(order_inserts), 1)
+        self.assertEquals(OpenOrderCounter.get_open_orders(), 2)
+
+        order_ids = sorted(result['order']['id'] for result in response.data)
+        events = OrderStatusEvent.objects.order_by('order_id').values_list('order_id', 'status')
+        self.assertEquals(list(events), [(order_id, Order.ORDER_PLACED) for order_id in order_ids])
+        self.assertEquals(DishDemandCount.objects.get(dish=self.dish).quantity, 4)
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRouterTestCase(ConfigurationSettingsCacheMixin, TestCase):
+    def tearDown(self):
+        super(ReplicaRouterTestCase, self).tearDown()
+        unpin()
+
+    def test_reads_leave_the_replica_after_a_write(self):
+        self.assertEquals(router.db_for_read(Order), 'default')
+        with use_replica():
+            self.assertEquals(router.db_for_read(Order), 'replica')
+            with use_primary():
+                self.assertEquals(router.db_for_read(OpenOrderCounter), 'default')
+            self.assertEquals(router.db_for_write(Order), 'default')
+            self.assertEquals(router.db_for_read(Order), 'default')
+
+    def test_pinning_middleware(self):
+        def write(request):
+            router.db_for_write(Order)
+            return HttpResponse()
+
+        def read(request):
+            with use_replica():
+                return HttpResponse(router.db_for_read(Order))
+
+        factory = RequestFactory()
+        response = ReplicaPinningMiddleware(write)(factory.post('/orders/'))
+        self.assertIn(ReplicaPinningMiddleware.COOKIE_NAME, response.cookies)
+        self.assertFalse(is_pinned())
+
+        factory.cookies[ReplicaPinningMiddleware.COOKIE_NAME] = '1'
+        self.assertEquals(ReplicaPinningMiddleware(read)(factory.get('/orders/')).content, b'default')
+        del factory.cookies[ReplicaPinningMiddleware.COOKIE_NAME]
+        response = ReplicaPinningMiddleware(read)(factory.get('/orders/'))
+        self.assertEquals(response.content, b'replica')
+        self.assertNotIn(ReplicaPinningMiddleware.COOKIE_NAME, response.cookies)
+
+    def test_task_unpins_when_it_ends(self):
+        router.db_for_write(Order)
+        self.assertTrue(is_pinned())
+        task_postrun.send(sender=place_pending_orders, task=place_pending_orders)
+        self.assertFalse(is_pinned())
+
+
+@skipUnless('replica' in settings.DATABASES, 'needs a second database alias standing in for the replica')
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaReadsTestCase(ConfigurationSettingsCacheMixin, TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        # as a fresh process would be, the writes setting up the test databases pinned this thread to the primary
+        unpin()
+
+    def tearDown(self):
+        super(ReplicaReadsTestCase, self).tearDown()
+        unpin()
+
+    def test_export_data_reads_the_replica(self):
+        PerformanceMetrics.objects.using('replica').create(average_throughput=3,
+                                                           average_turnaround_time=timedelta(minutes=5))
+
+        output = StringIO()
+        call_command('export_data', 'performance_metrics', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEquals(len(lines), 2)
+        self.assertEquals(lines[1].split(',')[3], '3')
+
+
+class ConnectionPoolTestCase(ConfigurationSettingsCacheMixin, TestCase):
+    def create_pool(self, **options):
+        options = dict({'max_size': 1, 'timeout': 0.01, 'max_age': None, 'health_check_after': None}, **options)
+        return ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False),
+                              check=lambda connection: connection.execute('SELECT 1'), **options)
+
+    def test_connections_are_reused_until_too_old(self):
+        pool = self.create_pool()
+        connection = pool.checkout()
+        self.assertRaises(PoolTimeout, pool.checkout)
+        pool.checkin(connection)
+        self.assertIs(pool.checkout(), connection)
+        metrics = pool.metrics()
+        self.assertEquals((metrics['checkouts'], metrics['waits'], metrics['timeouts'], metrics['connects']),
+                          (3, 1, 1, 1))
+
+        pool.max_age = 0
+        pool.checkin(connection)
+        self.assertIsNot(pool.checkout(), connection)
+        self.assertEquals(pool.metrics()['discarded'], 1)
+
+    def test_broken_connections_are_replaced(self):
+        pool = self.create_pool(health_check_after=0)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        connection.close()
+        replacement = pool.checkout()
+        self.assertIsNot(replacement, connection)
+        self.assertEquals(replacement.execute('SELECT 1').fetchone(), (1, ))
+        self.assertEquals(pool.metrics()['size'], 1)
+
+    def test_pool_metrics_are_for_staff(self):
+        client = APIClient()
+        url = reverse('squad_pantry_app:database-pool')
+        client.force_authenticate(SquadUser.objects.create(username="prakhar"))
+        self.assertEquals(client.get(url).status_code, 403)
+        client.force_authenticate(SquadUser.objects.create(username="admin", is_staff=True))
+        self.assertEquals(client.get(url).data['process'], 'web')
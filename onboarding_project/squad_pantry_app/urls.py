@@ -1,6 +1,7 @@
 from django.conf.urls import url
 from django.contrib.auth.decorators import login_required
-from squad_pantry_app.views import OrderViewSet, MetricView
+from squad_pantry_app.views import OrderViewSet, MetricView, MenuView, KitchenQueueView, OrderEventsView, \
+    PerformanceView, OrderRequestView, PrepAheadView, KitchenSlotsView, DatabasePoolView
 
 app_name = 'squad_pantry_app'
 
@@ -8,6 +9,9 @@ order_list = OrderViewSet.as_view({
     'get': 'list',
     'post': 'create'
 })
+order_bulk = OrderViewSet.as_view({
+    'post': 'bulk',
+})
 order_detail = OrderViewSet.as_view({
     'get': 'retrieve',
 })
@@ -18,7 +22,16 @@ cancel_order = OrderViewSet.as_view({
 
 urlpatterns = [
     url(r'^admin/metrics', login_required(MetricView.as_view()), name='metrics'),
+    url(r'^admin/prep-ahead/$', login_required(PrepAheadView.as_view()), name='prep-ahead'),
+    url(r'^admin/performance/$', PerformanceView.as_view(), name='performance'),
+    url(r'^admin/database-pool/$', DatabasePoolView.as_view(), name='database-pool'),
+    url(r'^dishes/$', MenuView.as_view(), name='dish-list'),
+    url(r'^kitchen/queue/$', KitchenQueueView.as_view(), name='kitchen-queue'),
+    url(r'^kitchen/slots/$', KitchenSlotsView.as_view(), name='kitchen-slots'),
     url(r'^orders/$', order_list, name='order-list'),
+    url(r'^orders/bulk/$', order_bulk, name='order-bulk'),
+    url(r'^orders/events/$', OrderEventsView.as_view(), name='order-events'),
+    url(r'^orders/requests/(?P<handle>[0-9a-f-]+)/$', OrderRequestView.as_view(), name='order-request'),
     url(r'^orders/(?P<pk>[0-9]+)/$', order_detail, name='order-detail'),
     url(r'^orders/(?P<pk>[0-9]+)/cancel-order$', cancel_order, name='cancel-order'),
 ]
@@ -1,29 +1,280 @@
-from django.shortcuts import render
+import json
+import logging
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
 from django.views import View
-from squad_pantry_app.models import Order, OrderDishRelation, PerformanceMetrics
-from squad_pantry_app.serializer import OrderSerializer
-from squad_pantry_app.permissions import IsUserWhoPlacedOrder
-from rest_framework import permissions, viewsets
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags
+from squad_pantry_app.models import ArchivedOrder, Dish, Order, OrderDishRelation, OrderRequest, PerformanceMetrics, \
+    ConfigurationSettings, KitchenSlot
+from squad_pantry_app.serializer import OrderSerializer, BulkOrderSerializer, OrderHistorySerializer, \
+    OrderRequestSerializer
+from squad_pantry_app.pagination import OrderCursorPagination
+from squad_pantry_app.events import get_broker, order_channel
+from squad_pantry_app.forecasting import get_prep_ahead
+from squad_pantry_app.instrumentation import get_request_histograms
+from squad_pantry_app.permissions import IsUserWhoPlacedOrder, IsKitchenStaff
+from squad_pantry_app.pool import get_pool_metrics, get_process_type
+from squad_pantry_app.routers import use_replica
+from rest_framework import generics, permissions, status, viewsets
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+ORDER_PLACEMENT_SCHEDULED_KEY = 'squad_pantry_app:order_placement_scheduled'
+
+
+def schedule_order_placement():
+    """
+    Have the pending order requests placed in ORDER_REQUEST_DELAY seconds, unless that was already
+    scheduled from this process, so requests arriving meanwhile are placed together
+    """
+    # imported here, importing the views should not set up the Celery app
+    from kombu.exceptions import OperationalError
+    from onboarding_project.tasks import place_pending_orders
+
+    if not cache.add(ORDER_PLACEMENT_SCHEDULED_KEY, True, settings.ORDER_REQUEST_DELAY):
+        return
+    try:
+        place_pending_orders.apply_async(countdown=settings.ORDER_REQUEST_DELAY)
+    except OperationalError:
+        # the periodic run of place_pending_orders picks the requests up
+        cache.delete(ORDER_PLACEMENT_SCHEDULED_KEY)
+        logging.exception('Could not schedule the placement of pending orders')
 
 
 class OrderViewSet(viewsets.ModelViewSet):
     """
     Create Order, Cancel Order
+
+    Pass paginate=cursor to page through the order history with cursors instead of page numbers,
+    or include_archived=true to page through live and archived orders together, with page numbers only.
+    Pass mode=async when creating an order to have it queued and placed in the background.
+    Listing and retrieving orders read from the replica, see squad_pantry_app.routers.
     """
     serializer_class = OrderSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, IsUserWhoPlacedOrder)
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.request.query_params.get('paginate') == 'cursor':
+            self._paginator = OrderCursorPagination()
+        return super(OrderViewSet, self).paginator
+
     def get_queryset(self):
-        return Order.objects.filter(placed_by=self.request.user)
+        queryset = Order.objects.filter(placed_by=self.request.user).order_by('-created_at', '-id')
+        return self.get_serializer_class().setup_eager_loading(queryset)
+
+    def create(self, request, *args, **kwargs):
+        if request.query_params.get('mode') != 'async':
+            return super(OrderViewSet, self).create(request, *args, **kwargs)
+
+        # dishes and limits are checked when the order is placed, only the shape is validated here
+        serializer = BulkOrderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_request = OrderRequest.objects.create(placed_by=request.user,
+                                                    payload=OrderRequest.dump_order(serializer.validated_data))
+        transaction.on_commit(schedule_order_placement)
+
+        location = reverse('squad_pantry_app:order-request', kwargs={'handle': order_request.handle})
+        return Response(OrderRequestSerializer(order_request).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location})
+
+    @use_replica()
+    def list(self, request, *args, **kwargs):
+        include_archived = request.query_params.get('include_archived') == 'true'
+        if not include_archived:
+            return super(OrderViewSet, self).list(request, *args, **kwargs)
+        if request.query_params.get('paginate') == 'cursor':
+            return Response({'detail': 'include_archived can not be combined with paginate=cursor'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        page = self.paginate_queryset(ArchivedOrder.get_order_history(request.user))
+        return self.get_paginated_response(self.serialize_history(page))
+
+    @use_replica()
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super(OrderViewSet, self).retrieve(request, *args, **kwargs)
+        except Http404:
+            archived_order = ArchivedOrder.objects.filter(placed_by=request.user, pk=kwargs['pk']).values(
+                *ArchivedOrder.HISTORY_FIELDS).first()
+            if archived_order is None:
+                raise
+            archived_order['archived'] = True
+            return Response(self.serialize_history([archived_order])[0])
+
+    def serialize_history(self, orders):
+        for order in orders:
+            order['placed_by'] = self.request.user.username
+        return OrderHistorySerializer(ArchivedOrder.add_dishes(orders), many=True).data
+
+    def bulk(self, request):
+        """
+        Place a list of orders at once, answering with the placed order or the errors for each of them
+        """
+        serializer = BulkOrderSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        results = Order.place_orders(request.user, serializer.validated_data)
+
+        placed_ids = [result['order'].id for result in results if result['order'] is not None]
+        placed_orders = OrderSerializer.setup_eager_loading(Order.objects.filter(id__in=placed_ids)).in_bulk()
+        response = [
+            {'order': OrderSerializer(placed_orders[result['order'].id]).data}
+            if result['order'] is not None else {'errors': result['errors']}
+            for result in results
+        ]
+
+        if len(placed_ids) == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif placed_ids:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(response, status=response_status)
+
+
+class OrderRequestView(generics.RetrieveAPIView):
+    """
+    Poll an order placed with mode=async until it is placed or failed.
+    Order requests are placed by a Celery worker, whose events only reach the /orders/events/ streams when
+    settings.ORDER_EVENTS_BROKER is shared between processes, as KombuBroker is. Failures are only seen here.
+    """
+    serializer_class = OrderRequestSerializer
+    permission_classes = (permissions.IsAuthenticated, )
+    lookup_field = 'handle'
+
+    def get_queryset(self):
+        return OrderRequest.objects.filter(placed_by=self.request.user)
+
+
+class OrderEventsView(APIView):
+    """
+    Server-Sent Events stream of status changes of the orders placed by the user
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def get(self, request):
+        subscription = get_broker().subscribe(order_channel(request.user.id))
+        # the stream needs no database and lasts until the client goes away, while Django only closes the
+        # connections once it ends: give them back to the pool now rather than hold one per open stream
+        for database in connections.all():
+            if not database.in_atomic_block:
+                database.close()
+        response = StreamingHttpResponse(self.stream(subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # keep nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def stream(subscription):
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                message = subscription.get(timeout=settings.ORDER_EVENTS_HEARTBEAT)
+                if message is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield 'event: {0}\ndata: {1}\n\n'.format(message.get('event', 'status'), json.dumps(message))
+        finally:
+            subscription.close()
+
+
+class KitchenQueueView(generics.ListAPIView):
+    """
+    Open orders for the kitchen, ordered by the time preparation has to start
+    """
+    serializer_class = OrderSerializer
+    permission_classes = (IsKitchenStaff, )
+
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(Order.kitchen_queue())
+
+
+class KitchenSlotsView(APIView):
+    """
+    Slots scheduled orders can still be booked in, for the date given as date=YYYY-MM-DD or today.
+    An order fits in a slot if the prep time x quantity of its dishes is at most the available minutes.
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def get(self, request):
+        try:
+            day = parse_date(request.query_params.get('date', '')) or timezone.localdate()
+        except ValueError:
+            return Response({'detail': 'Invalid date'}, status=status.HTTP_400_BAD_REQUEST)
+        day_start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        try:
+            slots = KitchenSlot.get_available_slots(max(day_start, timezone.now()), day_start + timedelta(days=1))
+        except ConfigurationSettings.DoesNotExist:
+            return Response({'detail': 'Slots are not booked'}, status=status.HTTP_404_NOT_FOUND)
+        return Response([{'slot_start': slot_start, 'available_minutes': available}
+                         for slot_start, available in slots])
+
+
+class MenuView(APIView):
+    """
+    Available dishes. Send the ETag back in If-None-Match to get a 304 while the menu is unchanged
+    """
+
+    def get(self, request):
+        menu = Dish.get_menu()
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if menu['etag'] in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': menu['etag']})
+        return Response(menu['dishes'], headers={'ETag': menu['etag']})
+
+
+class PerformanceView(APIView):
+    """
+    Request timings of this process per view, as recorded by PerformanceMiddleware. DELETE starts them over
+    """
+    permission_classes = (permissions.IsAdminUser, )
+
+    def get(self, request):
+        return Response(get_request_histograms().summary())
+
+    def delete(self, request):
+        get_request_histograms().reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DatabasePoolView(APIView):
+    """
+    Checkouts, waits and timeouts of the database connection pools of this process
+    """
+    permission_classes = (permissions.IsAdminUser, )
+
+    def get(self, request):
+        return Response({'process': get_process_type(), 'pools': get_pool_metrics()})
+
+
+class PrepAheadView(View):
+    """
+    Dishes to prepare ahead for the next slots, from the demand forecast and the orders already scheduled
+    """
+    template_name = 'admin/prep_ahead.html'
+    SLOTS = 4
+
+    def get(self, request):
+        return render(request, self.template_name, {'prep_ahead': get_prep_ahead(timezone.now(), self.SLOTS)})
 
 
 class MetricView(View):
     template_name = 'admin/metrics.html'
 
+    @use_replica()
     def get(self, request):
         if len(request.GET) > 0:
-            if request.GET['end_date'] <= request.GET['start_date']:
-                error = 'End Date should be more recent than Start Date'
+            # the end date is included, so a single day is a valid range
+            if request.GET['end_date'] < request.GET['start_date']:
+                error = 'End Date should not be earlier than Start Date'
                 return render(request, self.template_name, {'error': error})
             throughput, turnaround_time = PerformanceMetrics.get_metrics_data(request.GET['start_date'],
                                                                               request.GET['end_date'])
@@ -31,8 +282,10 @@ class MetricView(View):
                 error = "No Records Found"
                 return render(request, self.template_name, {'error': error})
             else:
+                percentiles = PerformanceMetrics.get_percentiles(request.GET['start_date'], request.GET['end_date'])
                 return render(request, self.template_name, {'throughput': throughput,
                                                             'turnaround_time': turnaround_time,
+                                                            'percentiles': percentiles,
                                                             'start': request.GET['start_date'],
                                                             'end': request.GET['end_date']})
         return render(request, self.template_name)